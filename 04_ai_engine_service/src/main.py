@@ -32,6 +32,7 @@ from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 
@@ -74,6 +75,15 @@ try:
 except ImportError as e:
     logger.debug(f"⚠️ Could not import graphviz_generator: {e}")
 
+# orjson-backed default responses (falls back to FastAPI's stdlib JSONResponse)
+try:
+    import orjson  # noqa: F401 — ORJSONResponse only fails at render time without it
+    from fastapi.responses import ORJSONResponse
+    DefaultResponse = ORJSONResponse
+except ImportError:
+    DefaultResponse = JSONResponse
+    logger.debug("ℹ️ orjson not available, using stdlib JSON responses")
+
 
 # ---------------------------------------------------------------------------
 # Keep-alive task for Railway
@@ -146,7 +156,8 @@ app = FastAPI(
     title="StudyAI AI Engine",
     description="Advanced AI processing for educational content and reasoning",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=DefaultResponse
 )
 
 # Middleware: allow large request bodies for homework image endpoints
@@ -179,6 +190,15 @@ app.add_middleware(
 from src.middleware.service_auth import service_auth_middleware
 app.middleware("http")(service_auth_middleware)
 
+# AI engine errors keep the {"success": False, "error": ...} response shape
+from src.services.improved_openai_service import AIEngineError
+
+@app.exception_handler(AIEngineError)
+async def ai_engine_error_handler(request: Request, exc: AIEngineError):
+    logger.error(f"❌ {type(exc).__name__}: {exc}")
+    return JSONResponse(status_code=500, content={"success": False, "error": str(exc)})
+
+
 # ---------------------------------------------------------------------------
 # Register routers
 # ---------------------------------------------------------------------------
@@ -4,8 +4,10 @@ Homework Processing Endpoints
 
 Active endpoints:
   POST /api/v1/process-homework-image
+  POST /api/v1/process-homework-image-stream
   POST /api/v1/parse-homework-questions
   POST /api/v1/reparse-question
+  POST /api/v1/reparse-questions
   POST /api/v1/grade-question
   POST /api/v1/chat-image
   POST /api/v1/chat-image-stream
@@ -160,6 +162,21 @@ class ReparseQuestionResponse(BaseModel):
     error: Optional[str] = None
 
 
+class ReparseQuestionsRequest(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    base64_image: str
+    question_numbers: List[str]
+    question_hints: Optional[Dict[str, str]] = None  # question_number → hint
+
+
+class ReparseQuestionsResponse(BaseModel):
+    success: bool
+    questions: List[ParsedQuestion] = []
+    processing_time_ms: int
+    error: Optional[str] = None
+
+
 class DiagramQuestion(BaseModel):
     id: str
     question_number: Optional[str] = None
@@ -271,6 +288,20 @@ def normalize_subquestion_ids(questions: list) -> None:
             subq['id'] = f"{parent_num}{letter}"
 
 
+def _clean_reparsed_question(q: Any) -> None:
+    """Apply answer cleanup + subquestion ID normalization to a reparsed question."""
+    if not isinstance(q, dict):
+        return
+    if q.get("student_answer"):
+        q["student_answer"] = clean_student_answer(q["student_answer"])
+    if q.get("subquestions"):
+        for subq in q["subquestions"]:
+            if isinstance(subq, dict) and subq.get("student_answer"):
+                subq["student_answer"] = clean_student_answer(subq["student_answer"])
+        # Fix subquestion IDs to use the actual parent question number
+        normalize_subquestion_ids([q])
+
+
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
@@ -412,6 +443,34 @@ async def process_homework_image(request: HomeworkParsingRequest):
         )
 
 
+@router.post("/api/v1/process-homework-image-stream")
+async def process_homework_image_stream(request: HomeworkParsingRequest):
+    """
+    Parse homework images with real-time SSE streaming.
+    Emits each graded question as soon as it is generated, then an "end" event
+    with the same fields /api/v1/process-homework-image derives its response from.
+    """
+    async def stream_generator():
+        async for event in ai_service.parse_homework_image_events(
+            base64_image=request.base64_image,
+            custom_prompt=request.prompt,
+            student_context={"student_id": request.student_id},
+            parsing_mode=request.parsing_mode,
+            language=request.language or "en"
+        ):
+            yield f"data: {event}\n\n"
+
+    return StreamingResponse(
+        stream_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @router.post("/api/v1/parse-homework-questions", response_model=ParseHomeworkQuestionsResponse)
 async def parse_homework_questions(request: ParseHomeworkQuestionsRequest):
     """
@@ -592,15 +651,7 @@ async def reparse_question(request: ReparseQuestionRequest):
             )
 
         q = result["question"]
-        if isinstance(q, dict):
-            if q.get("student_answer"):
-                q["student_answer"] = clean_student_answer(q["student_answer"])
-            if q.get("subquestions"):
-                for subq in q["subquestions"]:
-                    if isinstance(subq, dict) and subq.get("student_answer"):
-                        subq["student_answer"] = clean_student_answer(subq["student_answer"])
-                # Fix subquestion IDs to use the actual parent question number
-                normalize_subquestion_ids([q])
+        _clean_reparsed_question(q)
 
         return ReparseQuestionResponse(
             success=True, question=q, processing_time_ms=processing_time
@@ -617,6 +668,48 @@ async def reparse_question(request: ReparseQuestionRequest):
         )
 
 
+@router.post("/api/v1/reparse-questions", response_model=ReparseQuestionsResponse)
+async def reparse_questions(request: ReparseQuestionsRequest):
+    """
+    Re-extract several questions from the same homework image in one Gemini call.
+    Batch form of /api/v1/reparse-question for when multiple cards need reparsing.
+    """
+    start_time = _time.time()
+    try:
+        result = await gemini_service.reparse_questions_batch(
+            base64_image=request.base64_image,
+            question_numbers=request.question_numbers,
+            question_hints=request.question_hints
+        )
+
+        processing_time = int((_time.time() - start_time) * 1000)
+
+        questions = [q for q in result.get("questions", []) if isinstance(q, dict)]
+        if not questions:
+            return ReparseQuestionsResponse(
+                success=False,
+                error=result.get("error", "Reparse returned no questions"),
+                processing_time_ms=processing_time
+            )
+
+        for q in questions:
+            _clean_reparsed_question(q)
+
+        return ReparseQuestionsResponse(
+            success=True, questions=questions, processing_time_ms=processing_time
+        )
+
+    except Exception as e:
+        processing_time = int((_time.time() - start_time) * 1000)
+        import traceback
+        traceback.print_exc()
+        return ReparseQuestionsResponse(
+            success=False,
+            error=f"Reparse error: {str(e)}",
+            processing_time_ms=processing_time
+        )
+
+
 @router.post("/api/v1/locate-diagram-regions", response_model=LocateDiagramRegionsResponse)
 async def locate_diagram_regions(request: LocateDiagramRegionsRequest):
     """
@@ -4,18 +4,22 @@ Question Processing Endpoints
 
 Active endpoints:
   POST /api/v1/process-question
+  POST /api/v1/process-question/stream
   POST /api/v1/evaluate-answer
 
 Redacted (no backend proxy, moved to main.REDACTED.py):
   GET  /api/v1/subjects
   GET  /api/v1/personalization/{student_id}
 """
+import json as _json
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ConfigDict
 
 from typing import Dict, List, Optional, Any
 
-from src.services.improved_openai_service import EducationalAIService
+from src.services.improved_openai_service import AIEngineError, EducationalAIService
 from src.services.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -101,9 +105,6 @@ async def process_question(request: QuestionRequest):
             include_followups=request.include_followups
         )
 
-        if not result["success"]:
-            raise HTTPException(status_code=500, detail=result.get("error", "Processing failed"))
-
         processing_time = int((time.time() - start_time) * 1000)
 
         advanced_response = AdvancedReasoningResponse(
@@ -134,10 +135,52 @@ async def process_question(request: QuestionRequest):
             }
         )
 
-    except HTTPException:
+    except AIEngineError:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Question processing error: {str(e)}")
+        # Re-raised as AIEngineError so every failure of this endpoint shares the
+        # {"success": False, "error": ...} shape from main.py's handler
+        raise AIEngineError(f"Question processing error: {str(e)}") from e
+
+
+@router.post("/api/v1/process-question/stream")
+async def process_question_stream(request: QuestionRequest):
+    """
+    Process an educational question with real-time SSE streaming.
+
+    Answer deltas are forwarded as they arrive; the final "end" event carries
+    the reasoning steps, key concepts and follow-up questions.
+    """
+    try:
+        async def stream_generator():
+            async for chunk in ai_service.process_educational_question_stream(
+                question=request.question,
+                subject=request.subject,
+                student_context={
+                    "student_id": request.student_id,
+                    **(request.context or {})
+                },
+                include_followups=request.include_followups
+            ):
+                yield f"data: {chunk}\n\n"
+
+        return StreamingResponse(
+            stream_generator(),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "X-Accel-Buffering": "no"
+            }
+        )
+
+    except Exception as e:
+        error_msg = f"Question streaming endpoint error: {str(e)}"
+
+        async def error_generator():
+            yield f"data: {_json.dumps({'type': 'error', 'error': error_msg})}\n\n"
+
+        return StreamingResponse(error_generator(), media_type="text/event-stream")
 
 
 @router.post("/api/v1/evaluate-answer")
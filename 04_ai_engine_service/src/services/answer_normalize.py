@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Answer Normalization for Exact-Match Grading
+
+Normalizes student and reference answers so trivially equal answers
+("A. x = 1" vs "x=1", "½" vs "1/2") can be matched without an AI call.
+
+Kept as a standalone, fully type-annotated module with no service
+dependencies so it can be compiled with mypyc:
+
+    mypyc src/services/answer_normalize.py
+
+The compiled extension is picked up automatically in place of this file;
+the pure-Python version remains the fallback.
+"""
+
+import re
+
+_RE_MC_PREFIX = re.compile(r'^[(]?[A-Za-z][.)\]]?\s*')
+# Input is already lowercased when this runs; alternatives are longest-first
+_RE_UNIT = re.compile(r'(\d)\s+(km/h|m/s|mph|min|km|cm|mm|kg|mg|ml|°c|°f|m|g|l|s|h)')
+_RE_LATEX_DELIM = re.compile(r'\\\[|\\\]|\\\(|\\\)')
+_FILLER_PHRASES = ("the answer is", "answer:", "result:", "solution:", "equals")
+_RE_FILLER = re.compile('|'.join(map(re.escape, _FILLER_PHRASES)))
+_RE_OP_SPACE = re.compile(r' ([+\-*/=]) ')
+_FRACTION_MAP = {
+    "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4",
+    "⅕": "1/5", "⅖": "2/5", "⅗": "3/5", "⅘": "4/5", "⅙": "1/6", "⅚": "5/6",
+    "⅛": "1/8", "⅜": "3/8", "⅝": "5/8", "⅞": "7/8"
+}
+_FRACTION_TRANS = str.maketrans(_FRACTION_MAP)
+
+
+def normalize_answer(answer: str) -> str:
+    """
+    Normalize an answer string for comparison across all question types.
+
+    Handles:
+    - Multiple choice option prefix removal (A., B., a), etc.)
+    - True/False abbreviations (T/F → true/false)
+    - Mathematical expressions (spacing, operators)
+    - Fractions and unicode symbols (½ → 1/2)
+    - Units normalization (5 km → 5km)
+    - Filler phrase removal ("the answer is", etc.)
+    - Whitespace and case normalization
+    - LaTeX math delimiters
+
+    Args:
+        answer: Raw answer string to normalize
+
+    Returns:
+        Normalized string for comparison
+    """
+    if not answer:
+        return ""
+
+    # Step 1: Trim whitespace
+    normalized = answer.strip()
+
+    # Step 2: Remove multiple choice option prefixes (BEFORE lowercasing)
+    # Patterns: "A.", "A)", "(A)", "a.", "a)", "(a)", etc.
+    # This fixes bug where "A.x=1" was marked wrong when correct answer is "x=1"
+    normalized = _RE_MC_PREFIX.sub('', normalized)
+
+    # Step 3: Lowercase for case-insensitive comparison
+    normalized = normalized.lower()
+
+    # Step 4: True/False normalization - expand abbreviations
+    # "t" → "true", "f" → "false" (after lowercasing)
+    if normalized == "t":
+        normalized = "true"
+    elif normalized == "f":
+        normalized = "false"
+
+    # Fast path: short ASCII alphanumeric answers ("4", "b", "true") have
+    # nothing left for steps 5-11 to change
+    if len(normalized) <= 5 and normalized.isascii() and normalized.isalnum():
+        return normalized
+
+    # Step 5: Remove common filler words and phrases (already lowercased)
+    normalized = _RE_FILLER.sub('', normalized)
+
+    # Step 6: Normalize mathematical expressions - remove spaces around operators
+    # " + ", " - ", " * ", " / ", " = " collapse in a single pass
+    if ' ' in normalized:
+        normalized = _RE_OP_SPACE.sub(r'\1', normalized)
+
+    # Step 7: Normalize fractions and unicode symbols (½ → 1/2, etc.)
+    normalized = normalized.translate(_FRACTION_TRANS)
+
+    # Step 8: Normalize units - remove spaces between number and unit
+    # "5 km" → "5km", "10 m/s" → "10m/s"
+    normalized = _RE_UNIT.sub(r'\1\2', normalized)
+
+    # Step 9: Remove LaTeX math delimiters for comparison
+    # Remove \( ... \) and \[ ... \] delimiters
+    if '\\' in normalized:
+        normalized = _RE_LATEX_DELIM.sub('', normalized)
+
+    # Step 10-11: Collapse whitespace runs into single spaces and trim.
+    # str.split() uses the same whitespace set as \s and drops the edges,
+    # so a single C-level pass replaces the regex sub plus strip()
+    return ' '.join(normalized.split())
+
+
+def answers_equal(a: str, b: str) -> bool:
+    """
+    Compare two answers after normalization.
+
+    Byte-identical raw strings (common for numeric and single-letter MCQ
+    answers) short-circuit without normalizing either side.
+    """
+    if a is b or a == b:
+        return True
+    return normalize_answer(a) == normalize_answer(b)
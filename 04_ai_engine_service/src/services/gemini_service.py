@@ -8,10 +8,12 @@ Alternative to OpenAI for homework parsing and grading.
 
 import os
 import re
+import sys
 import json
 import base64
 import time
 import asyncio
+import functools
 from typing import Dict, List, Optional, Any
 from dotenv import load_dotenv
 
@@ -34,8 +36,330 @@ except ImportError as e:
     genai = None
     genai_types = None
 
+# Optional fast JSON decoder — orjson raises orjson.JSONDecodeError, a subclass
+# of json.JSONDecodeError, so existing except clauses keep working
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # Import subject-specific prompt generator
 from .subject_prompts import get_subject_specific_rules
+# Import type × subject grading prompt builder
+from .grading_prompts import build_complete_grading_prompt
+# Import answer normalization (standalone, mypyc-compilable)
+from .answer_normalize import normalize_answer, answers_equal
+
+# Gemini finish_reason → outcome. Keyed by both the int value (legacy proto enum)
+# and the string value (NEW API str enum) so a single dict lookup covers both.
+# FinishReason enum: FINISH_REASON_UNSPECIFIED=0, STOP=1, MAX_TOKENS=2, SAFETY=3, RECITATION=4, OTHER=5
+_FINISH_REASONS = {
+    1: "ok", "STOP": "ok",
+    2: "max_tokens", "MAX_TOKENS": "max_tokens",
+    3: "safety", "SAFETY": "safety",
+    4: "recitation", "RECITATION": "recitation",
+    5: "other", "OTHER": "other",
+}
+
+
+# Precompiled patterns for response parsing
+_RE_JSON_CODEFENCE = re.compile(r'```json\n?')
+_RE_CODEFENCE = re.compile(r'```\n?')
+_RE_FENCED_BLOCK = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.DOTALL)
+_RE_SCORE = re.compile(r'SCORE:\s*([\d.]+)', re.IGNORECASE)
+_RE_IS_CORRECT = re.compile(r'IS_CORRECT:\s*(true|false)', re.IGNORECASE)
+_RE_FEEDBACK = re.compile(r'FEEDBACK:\s*(.+?)(?=\n(?:CONFIDENCE|CORRECT_ANSWER)|$)', re.IGNORECASE | re.DOTALL)
+_RE_CONFIDENCE = re.compile(r'CONFIDENCE:\s*([\d.]+)', re.IGNORECASE)
+_RE_CORRECT_ANSWER = re.compile(r'CORRECT_ANSWER:\s*(.+?)(?=$)', re.IGNORECASE | re.DOTALL)
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _find_json_object(text: str) -> Optional[str]:
+    """
+    Return the first balanced {...} object in text, or None.
+
+    Single left-to-right pass tracking brace depth; braces inside JSON string
+    literals (including escaped quotes) are ignored.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def _intern_question_ids(questions: Any) -> None:
+    """
+    Intern short question ids ("1", "2", "1a") in place, including subquestions,
+    so the many id comparisons and dict lookups downstream are pointer compares.
+    """
+    if not isinstance(questions, list):
+        return
+    for q in questions:
+        if not isinstance(q, dict):
+            continue
+        qid = q.get("id")
+        if isinstance(qid, str) and len(qid) <= 8:
+            q["id"] = sys.intern(qid)
+        _intern_question_ids(q.get("subquestions"))
+
+
+# Base parse prompt (universal for all subjects). Subject rules are spliced in at
+# __SUBJECT_RULES__ by plain token replacement, so JSON braces are written literally.
+_PARSE_PROMPT_TEMPLATE = """Extract all questions and student answers from homework image.
+Return ONE JSON object only. No markdown. No explanation.
+First character MUST be "{". Last character MUST be "}".
+
+================================================================================
+JSON SCHEMA
+================================================================================
+{
+  "subject": "Math|Physics|Chemistry|Biology|English|History|Geography|Computer Science|Art|Music|Physical Education|Others: [description]",
+  "subject_confidence": 0.95,
+  "total_questions": 2,
+  "questions": [
+    {
+      "id": "1",
+      "question_number": "1",
+      "is_parent": true,
+      "has_subquestions": true,
+      "parent_content": "Solve the following.",
+      "subquestions": [
+        {"id": "1a", "question_text": "...", "student_answer": "...", "question_type": "calculation"}
+      ]
+    },
+    {
+      "id": "2",
+      "question_number": "2",
+      "question_text": "What is 2+2?",
+      "student_answer": "4",
+      "question_type": "short_answer",
+      "need_image": false
+    }
+  ],
+  "handwriting_evaluation": {
+    "has_handwriting": true|false,
+    "score": 0-10 or null,
+    "feedback": "Brief assessment <150 chars" or null
+  }
+}
+
+================================================================================
+📚 SUBJECT SELECTION
+================================================================================
+Select the most specific subject from the predefined list:
+   Math, Physics, Chemistry, Biology, English, History, Geography, Computer Science, Art, Music, Physical Education
+
+⚠️ If homework does NOT match any predefined subject:
+   - Use format: "Others: [brief subject name]"
+   - Example: "Others: French", "Others: Economics", "Others: Social Studies"
+   - Keep description SHORT (1-3 words max)
+   - Be SPECIFIC (not "Others: Language" - use "Others: Spanish")
+
+================================================================================
+🖊️ HANDWRITING EVALUATION (Pro Mode)
+================================================================================
+Assess handwriting clarity using this 5-tier rubric:
+- 9-10: Exceptional - Very clear, consistent, easily readable
+- 7-8: Clear - Well-formed letters, good spacing, readable
+- 5-6: Readable - Some inconsistency but understandable
+- 3-4: Difficult - Hard to read, poor spacing/formation
+- 0-2: Illegible - Very difficult to decipher
+
+================================================================================
+🌐 LANGUAGE PRESERVATION (CRITICAL)
+================================================================================
+⚠️ PRESERVE the original language of the homework in ALL text fields:
+- If homework is in Chinese (Simplified/Traditional) → question_text, student_answer, parent_content MUST be in Chinese
+- If homework is in English → question_text, student_answer, parent_content MUST be in English
+- DO NOT translate or change the language
+- Extract text exactly as it appears in the image
+- Keep mathematical symbols, LaTeX, and numbers unchanged
+
+FIELD RULES:
+- id: ALWAYS string. Top-level questions: the question_number exactly ("1", "5", "12"). Subquestions: MUST use the ACTUAL parent question_number as prefix + letter suffix — e.g. subquestions of question 5 → "5a", "5b", "5c". NEVER use "1" as the prefix for subquestions of a non-first question.
+- Regular questions: MUST have question_text, student_answer, question_type, need_image
+- Parent questions: MUST have is_parent, has_subquestions, parent_content, subquestions
+- need_image: true if the question requires seeing a visual element to answer correctly. Set true for ANY of: diagram, graph, chart, figure, table, image, picture, drawing, illustration, shaded shape, fraction model, number line, clock face, grid, coin/money image, geometric figure, map, bar graph, pie chart, measurement diagram, or any visual the student must observe or interact with. Set false ONLY if the question is purely text-based with no visual component. When in doubt, set true.
+  For parent questions with subquestions — decide based on visual structure:
+  • SHARED visual (one diagram/figure that all subquestions refer to, most common case) → set need_image=true on the PARENT ONLY. Do NOT set need_image on the subquestions.
+  • INDEPENDENT visuals (each subquestion has its own distinct diagram) → set need_image=true on the specific subquestions only. Parent does NOT need need_image.
+  • MIXED (shared context image + some subquestions also have their own separate diagram) → parent gets need_image=true; only the specific subquestion(s) with their own distinct image also get need_image=true.
+  Default to SHARED when uncertain — it is far more common for subquestions to share one diagram than to each have their own.
+- Omit fields that don't apply (DO NOT use null)
+- questions array ONLY contains top-level questions
+- total_questions = questions.length
+
+================================================================================
+CORE PRINCIPLE: VISION FIRST
+================================================================================
+⚠️ CRITICAL: What you SEE in the image > What the question text says
+
+When extracting subquestions:
+- If IMAGE shows: a. b. c. d. (4 items)
+- But PARENT TEXT says: "in a-b" (mentions only 2)
+- YOU MUST: Extract ALL 4 items (a, b, c, d)
+
+Rule: Question text is NOT an extraction instruction. Always trust visual markers.
+
+================================================================================
+EXTRACTION RULES
+================================================================================
+
+RULE 1 - SCAN ENTIRE PAGE:
+- Top→bottom, left→right
+- Include content near margins, dividers, corners
+
+RULE 2 - QUESTION NUMBER FORMATS:
+Accept: "1", "1.", "1)", "Q1", "Q1:", "Problem 1", "#1", "I.", "II."
+
+RULE 3 - PARENT QUESTION DETECTION:
+IF any of these patterns exist:
+  A) Question has lettered/numbered sub-items (a,b,c... or i,ii,iii...)
+  B) Long passage/context (2+ paragraphs) followed by numbered questions
+  C) Diagram/chart with multiple numbered questions referring to it
+THEN classify as parent question.
+
+Examples:
+- "Solve the following: a) 2+2  b) 3+3" → parent question
+- "Read passage... [3 paragraphs]. 1. What...? 2. Where...?" → parent question (passage = parent_content)
+- "Look at the diagram. 1. Label A. 2. Label B." → parent question (if diagram present)
+
+
+RULE 4 - SUBQUESTION EXTRACTION (VISION-FIRST):
+IF parent question exists:
+  1. LOOK at the IMAGE for visual markers (a. b. c. d...)
+  2. Extract EVERY marker you SEE visually
+  3. IGNORE what parent text says ("in a-b", "solve these", etc.)
+  4. STOP ONLY when:
+     - Next top-level number appears (e.g., "3.", "4.")
+     - Section divider
+     - End of page
+
+RULE 5 - COMBINE RULE (TWO QUESTIONS UNDER ONE NUMBER):
+IF multiple question sentences under SAME printed number
+AND no new printed number between them
+THEN combine into ONE question.
+
+================================================================================
+QUESTION TYPE DETECTION & PARSING
+================================================================================
+
+TYPE 1 - MULTIPLE CHOICE (question_type: "multiple_choice"):
+- Has lettered options: A) ... B) ... C) ... D) ...
+- Student circles or marks one option
+- Extract: question_text (include all options), student_answer (circled letter)
+
+TYPE 2 - TRUE/FALSE (question_type: "true_false"):
+- Question with True/False choices
+- Student circles one
+- Extract: question_text, student_answer ("True" or "False")
+
+TYPE 3 - FILL IN BLANK (question_type: "fill_blank"):
+⚠️ SPECIAL HANDLING for multiple blanks:
+
+Example: "The boy _____ at _____ with his _____."
+Student wrote: "is playing" "home" "dad" (in 3 blanks)
+
+CORRECT format:
+- question_text: "The boy _____ at _____ with his _____."
+- student_answer: "is playing | home | dad" (use | separator)
+
+IF multiple blanks:
+- Keep question_text with _____ markers
+- Combine ALL answers with " | " separator in ORDER
+
+TYPE 4 - SHORT ANSWER (question_type: "short_answer"):
+- Brief written response (1-3 sentences)
+- Extract exactly as written
+
+TYPE 5 - LONG ANSWER (question_type: "long_answer"):
+- Extended response (paragraph+)
+- Extract full text
+
+================================================================================
+ANSWER EXTRACTION (CRITICAL)
+================================================================================
+- student_answer = EXACT handwriting (even if wrong)
+- Never calculate, infer, or correct
+- If unclear or cut off → set ""
+- For multi-blank: use " | " to separate (see TYPE 3 above)
+- For two-part question: label each answer with context
+
+MATHEMATICAL EXPRESSIONS:
+Use LaTeX for ALL mathematical formulas, symbols, and equations in question_text and student_answer.
+Example: use $\frac{1}{2}$ instead of 1/2, $x^2 + 3x = 0$ instead of x^2 + 3x = 0.
+
+__SUBJECT_RULES__
+
+================================================================================
+OUTPUT CHECKLIST
+================================================================================
+1. ✓ Scanned entire page?
+2. ✓ Used VISION FIRST (not limited by question text)?
+3. ✓ Extracted ALL visual markers (a, b, c, d...)?
+4. ✓ Correct question_type for each question?
+5. ✓ Multi-blank answers use " | " separator?
+6. ✓ total_questions = top-level questions only?
+7. ✓ Valid JSON with no markdown?
+"""
+
+
+@functools.lru_cache(maxsize=32)
+def _build_parse_prompt_cached(subject_key: str, multi_page: bool) -> str:
+    """
+    Assemble the parse prompt for a subject. The subject set is small and fixed,
+    so each (subject, multi_page) prompt is built once and reused.
+
+    Cached as str, not pre-encoded bytes: genai_types.Part.from_text() only
+    accepts str and the SDK does its own request serialization.
+    """
+    # Get subject-specific rules (empty string if General/unknown)
+    subject_rules = get_subject_specific_rules(subject_key)
+
+    # Combine base prompt with subject-specific rules
+    # If subject_rules is empty (General/unknown), it won't add anything
+    prompt = _PARSE_PROMPT_TEMPLATE.replace("__SUBJECT_RULES__", subject_rules)
+
+    # Multi-page only: inject pageNumber into schema and field rules
+    if multi_page:
+        prompt = prompt.replace(
+            '      "question_number": "1",\n      "is_parent": true,',
+            '      "question_number": "1",\n      "pageNumber": 1,\n      "is_parent": true,'
+        )
+        prompt = prompt.replace(
+            '      "question_number": "2",\n      "question_text":',
+            '      "question_number": "2",\n      "pageNumber": 1,\n      "question_text":'
+        )
+        prompt = prompt.replace(
+            "- id: ALWAYS string.",
+            "- pageNumber: Integer. Which page (image) this top-level question appears on (1-based). "
+            "Use the image index where the question physically appears: first image → 1, second image → 2, etc.\n"
+            "- id: ALWAYS string."
+        )
+
+    return prompt
 
 
 class GeminiEducationalAIService:
@@ -218,6 +542,9 @@ class GeminiEducationalAIService:
                 }
 
             # Call Gemini API (async)
+            # Not streamed: the finish_reason check below needs the final candidate,
+            # JSON mode disables streaming on some models (see TTFT path above), and
+            # raw_decode of the full text is negligible next to API latency.
             response = await self.client.aio.models.generate_content(
                 model=self.model_name,
                 contents=[image_part, genai_types.Part.from_text(text=system_prompt)],  # Image FIRST, then prompt
@@ -246,6 +573,7 @@ class GeminiEducationalAIService:
 
             # Validate and fix total_questions count
             questions_array = result.get("questions", [])
+            _intern_question_ids(questions_array)
             actual_total = len(questions_array)
 
             if actual_total == 0 and result.get("subject", "Unknown") == "Unknown":
@@ -374,6 +702,7 @@ class GeminiEducationalAIService:
             result = self._extract_json_from_response(raw_response)
 
             questions = result.get("questions", [])
+            _intern_question_ids(questions)
             logger.info(f"📊 Multi-page parse: {len(questions)} questions from {n} pages")
 
             return {
@@ -457,13 +786,10 @@ class GeminiEducationalAIService:
         # PRE-VALIDATION: Check for exact match before calling AI
         # This prevents false negatives when answers are identical
         if correct_answer:
-            normalized_student = self._normalize_answer(student_answer)
-            normalized_correct = self._normalize_answer(correct_answer)
-
-            if normalized_student == normalized_correct:
+            if self._answers_equal(student_answer, correct_answer):
                 logger.debug(f"✅ EXACT MATCH DETECTED - Skipping AI grading")
-                logger.debug(f"   Student:  '{normalized_student[:50]}'")
-                logger.debug(f"   Correct:  '{normalized_correct[:50]}'")
+                logger.debug(f"   Student:  '{str(student_answer)[:50]}'")
+                logger.debug(f"   Correct:  '{str(correct_answer)[:50]}'")
                 return {
                     "success": True,
                     "grade": {
@@ -550,23 +876,20 @@ class GeminiEducationalAIService:
                                else generation_config.get('max_output_tokens', 'unknown'))
             if response.candidates and len(response.candidates) > 0:
                 finish_reason = response.candidates[0].finish_reason
-                finish_reason_str = str(finish_reason)
-                logger.debug(f"🔍 Grading finish reason: {finish_reason} (string: '{finish_reason_str}')")
+                reason = _FINISH_REASONS.get(getattr(finish_reason, 'value', finish_reason), "unknown")
+                logger.debug(f"🔍 Grading finish reason: {finish_reason} ({reason})")
 
                 # Log response metadata for debugging
                 logger.debug(f"   📊 Model used: {model_name}")
                 logger.debug(f"   📊 Max output tokens configured: {_log_max_tokens}")
                 logger.debug(f"   📊 Response candidates count: {len(response.candidates)}")
 
-                # Check for MAX_TOKENS error (NEW API uses enum, not int)
-                # Possible values: STOP, MAX_TOKENS, SAFETY, RECITATION, OTHER
-                # FinishReason enum: FINISH_REASON_UNSPECIFIED=0, STOP=1, MAX_TOKENS=2, SAFETY=3, RECITATION=4, OTHER=5
-                if "MAX_TOKENS" in finish_reason_str or finish_reason == 2:  # ⚠️ FIXED: MAX_TOKENS = 2, not 3
+                if reason == "max_tokens":
                     logger.debug(f"⚠️ WARNING: Grading response hit MAX_TOKENS limit!")
                     logger.debug(f"   Current max_output_tokens: {_log_max_tokens}")
                     logger.debug(f"   Question text length: {len(question_text)} chars")
                     logger.debug(f"   Student answer length: {len(student_answer)} chars")
-                    logger.debug(f"   Finish reason: {finish_reason} / {finish_reason_str}")
+                    logger.debug(f"   Finish reason: {finish_reason}")
                     logger.debug(f"   Consider: 1) Increase max_output_tokens (currently {_log_max_tokens})")
                     logger.debug(f"            2) Simplify grading prompt")
 
@@ -579,16 +902,16 @@ class GeminiEducationalAIService:
 
                     return {
                         "success": False,
-                        "error": f"Token limit (finish_reason={finish_reason}/{finish_reason_str}, max_tokens={_log_max_tokens}). Model: {model_name}"
+                        "error": f"Token limit (finish_reason={finish_reason}, max_tokens={_log_max_tokens}). Model: {model_name}"
                     }
-                elif finish_reason == 3:  # SAFETY
+                elif reason == "safety":
                     logger.debug(f"⚠️ Response blocked by SAFETY filter")
                     return {
                         "success": False,
                         "error": "Response blocked by safety filter. Please check question content."
                     }
-                elif finish_reason != 1 and "STOP" not in finish_reason_str:  # Not normal completion
-                    logger.debug(f"⚠️ Unexpected finish reason: {finish_reason} / {finish_reason_str}")
+                elif reason != "ok":  # Not normal completion
+                    logger.debug(f"⚠️ Unexpected finish reason: {finish_reason}")
 
 
             # Parse JSON response (safely handle complex responses)
@@ -965,7 +1288,7 @@ class GeminiEducationalAIService:
 
         # Strategy 1: parse the full text directly
         try:
-            qs = _extract_list(json.loads(raw_text))
+            qs = _extract_list(_json_loads(raw_text))
             if qs:
                 return qs
         except (json.JSONDecodeError, ValueError):
@@ -975,7 +1298,7 @@ class GeminiEducationalAIService:
         m = re.search(r'\{.+\}', raw_text, re.DOTALL)
         if m:
             try:
-                qs = _extract_list(json.loads(m.group()))
+                qs = _extract_list(_json_loads(m.group()))
                 if qs:
                     return qs
             except (json.JSONDecodeError, ValueError):
@@ -985,7 +1308,7 @@ class GeminiEducationalAIService:
         m2 = re.search(r'\[.+\]', raw_text, re.DOTALL)
         if m2:
             try:
-                qs = _extract_list(json.loads(m2.group()))
+                qs = _extract_list(_json_loads(m2.group()))
                 if qs:
                     return qs
             except (json.JSONDecodeError, ValueError):
@@ -1003,7 +1326,7 @@ class GeminiEducationalAIService:
             if obj_open >= 0:
                 candidate = raw_text[obj_open: last_close + 1] + "]}"
                 try:
-                    qs = _extract_list(json.loads(candidate))
+                    qs = _extract_list(_json_loads(candidate))
                     if qs:
                         logger.debug(
                             f"⚠️ Recovered {len(qs)} questions from truncated JSON response"
@@ -1256,252 +1579,126 @@ RULES:
             text = self._extract_response_text(response)
             text = text.strip()
             if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-                text = text.strip()
-            return json.loads(text)
+                text = _RE_FENCED_BLOCK.match(text).group(1).strip()
+            result = _json_loads(text)
+            if isinstance(result, dict) and isinstance(result.get("question"), dict):
+                _intern_question_ids([result["question"]])
+            return result
         except Exception as e:
-            logger.error(f"reparse_single_question failed for Q{question_number}: {e}")
+            logger.error("reparse_single_question failed for Q%s: %s", question_number, e)
             raise
 
-    def _build_parse_prompt(self, subject: Optional[str] = None, multi_page: bool = False) -> str:
+    async def reparse_questions_batch(
+        self,
+        base64_image: str,
+        question_numbers: List[str],
+        question_hints: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
         """
-        Build homework parsing prompt with optional subject-specific rules.
+        Re-extract several questions from the same homework image in ONE Gemini call.
 
-        Args:
-            subject: Subject name (e.g., "Math", "Physics", "English")
-                    If None or "General", uses universal rules only
-            multi_page: When True, adds pageNumber field to schema (multi-page batch only)
+        Batch counterpart of reparse_single_question: when multiple questions
+        were parsed inaccurately, this costs one round-trip instead of N.
 
-        Returns:
-            Complete parsing prompt combining base rules + subject rules
+        Returns a dict with {"questions": [...]} in the same order as question_numbers.
         """
+        if not question_numbers:
+            return {"questions": []}
 
-        # Get subject-specific rules (empty string if General/unknown)
-        subject_rules = get_subject_specific_rules(subject or "General")
+        hints = question_hints or {}
+        question_lines = "\n".join(
+            f'- {num}' + (f' (hint from student: "{hints[num]}")' if hints.get(num) else "")
+            for num in question_numbers
+        )
+        n = len(question_numbers)
+
+        prompt = f"""You are re-extracting {n} questions from this homework image.
+The initial extraction was inaccurate. Extract each of these questions with MAXIMUM precision:
+{question_lines}
 
-        # Base prompt (universal for all subjects)
-        base_prompt = """Extract all questions and student answers from homework image.
 Return ONE JSON object only. No markdown. No explanation.
-First character MUST be "{{". Last character MUST be "}}".
+First character MUST be {{. Last character MUST be }}.
 
-================================================================================
-JSON SCHEMA
-================================================================================
+SCHEMA:
 {{
-  "subject": "Math|Physics|Chemistry|Biology|English|History|Geography|Computer Science|Art|Music|Physical Education|Others: [description]",
-  "subject_confidence": 0.95,
-  "total_questions": 2,
   "questions": [
     {{
-      "id": "1",
-      "question_number": "1",
-      "is_parent": true,
-      "has_subquestions": true,
-      "parent_content": "Solve the following.",
-      "subquestions": [
-        {{"id": "1a", "question_text": "...", "student_answer": "...", "question_type": "calculation"}}
-      ]
-    }},
-    {{
-      "id": "2",
-      "question_number": "2",
-      "question_text": "What is 2+2?",
-      "student_answer": "4",
-      "question_type": "short_answer",
+      "id": "<question number>",
+      "question_number": "<question number>",
+      "question_text": "exact question text",
+      "student_answer": "exact student answer",
+      "question_type": "short_answer|calculation|multiple_choice|true_false|fill_blank|composition",
       "need_image": false
     }}
-  ],
-  "handwriting_evaluation": {{
-    "has_handwriting": true|false,
-    "score": 0-10 or null,
-    "feedback": "Brief assessment <150 chars" or null
-  }}
+  ]
 }}
 
-================================================================================
-📚 SUBJECT SELECTION
-================================================================================
-Select the most specific subject from the predefined list:
-   Math, Physics, Chemistry, Biology, English, History, Geography, Computer Science, Art, Music, Physical Education
-
-⚠️ If homework does NOT match any predefined subject:
-   - Use format: "Others: [brief subject name]"
-   - Example: "Others: French", "Others: Economics", "Others: Social Studies"
-   - Keep description SHORT (1-3 words max)
-   - Be SPECIFIC (not "Others: Language" - use "Others: Spanish")
-
-================================================================================
-🖊️ HANDWRITING EVALUATION (Pro Mode)
-================================================================================
-Assess handwriting clarity using this 5-tier rubric:
-- 9-10: Exceptional - Very clear, consistent, easily readable
-- 7-8: Clear - Well-formed letters, good spacing, readable
-- 5-6: Readable - Some inconsistency but understandable
-- 3-4: Difficult - Hard to read, poor spacing/formation
-- 0-2: Illegible - Very difficult to decipher
-
-================================================================================
-🌐 LANGUAGE PRESERVATION (CRITICAL)
-================================================================================
-⚠️ PRESERVE the original language of the homework in ALL text fields:
-- If homework is in Chinese (Simplified/Traditional) → question_text, student_answer, parent_content MUST be in Chinese
-- If homework is in English → question_text, student_answer, parent_content MUST be in English
-- DO NOT translate or change the language
-- Extract text exactly as it appears in the image
-- Keep mathematical symbols, LaTeX, and numbers unchanged
-
-FIELD RULES:
-- id: ALWAYS string. Top-level questions: the question_number exactly ("1", "5", "12"). Subquestions: MUST use the ACTUAL parent question_number as prefix + letter suffix — e.g. subquestions of question 5 → "5a", "5b", "5c". NEVER use "1" as the prefix for subquestions of a non-first question.
-- Regular questions: MUST have question_text, student_answer, question_type, need_image
-- Parent questions: MUST have is_parent, has_subquestions, parent_content, subquestions
-- need_image: true if the question requires seeing a visual element to answer correctly. Set true for ANY of: diagram, graph, chart, figure, table, image, picture, drawing, illustration, shaded shape, fraction model, number line, clock face, grid, coin/money image, geometric figure, map, bar graph, pie chart, measurement diagram, or any visual the student must observe or interact with. Set false ONLY if the question is purely text-based with no visual component. When in doubt, set true.
-  For parent questions with subquestions — decide based on visual structure:
-  • SHARED visual (one diagram/figure that all subquestions refer to, most common case) → set need_image=true on the PARENT ONLY. Do NOT set need_image on the subquestions.
-  • INDEPENDENT visuals (each subquestion has its own distinct diagram) → set need_image=true on the specific subquestions only. Parent does NOT need need_image.
-  • MIXED (shared context image + some subquestions also have their own separate diagram) → parent gets need_image=true; only the specific subquestion(s) with their own distinct image also get need_image=true.
-  Default to SHARED when uncertain — it is far more common for subquestions to share one diagram than to each have their own.
-- Omit fields that don't apply (DO NOT use null)
-- questions array ONLY contains top-level questions
-- total_questions = questions.length
-
-================================================================================
-CORE PRINCIPLE: VISION FIRST
-================================================================================
-⚠️ CRITICAL: What you SEE in the image > What the question text says
-
-When extracting subquestions:
-- If IMAGE shows: a. b. c. d. (4 items)
-- But PARENT TEXT says: "in a-b" (mentions only 2)
-- YOU MUST: Extract ALL 4 items (a, b, c, d)
-
-Rule: Question text is NOT an extraction instruction. Always trust visual markers.
-
-================================================================================
-EXTRACTION RULES
-================================================================================
-
-RULE 1 - SCAN ENTIRE PAGE:
-- Top→bottom, left→right
-- Include content near margins, dividers, corners
-
-RULE 2 - QUESTION NUMBER FORMATS:
-Accept: "1", "1.", "1)", "Q1", "Q1:", "Problem 1", "#1", "I.", "II."
-
-RULE 3 - PARENT QUESTION DETECTION:
-IF any of these patterns exist:
-  A) Question has lettered/numbered sub-items (a,b,c... or i,ii,iii...)
-  B) Long passage/context (2+ paragraphs) followed by numbered questions
-  C) Diagram/chart with multiple numbered questions referring to it
-THEN classify as parent question.
-
-Examples:
-- "Solve the following: a) 2+2  b) 3+3" → parent question
-- "Read passage... [3 paragraphs]. 1. What...? 2. Where...?" → parent question (passage = parent_content)
-- "Look at the diagram. 1. Label A. 2. Label B." → parent question (if diagram present)
-
-
-RULE 4 - SUBQUESTION EXTRACTION (VISION-FIRST):
-IF parent question exists:
-  1. LOOK at the IMAGE for visual markers (a. b. c. d...)
-  2. Extract EVERY marker you SEE visually
-  3. IGNORE what parent text says ("in a-b", "solve these", etc.)
-  4. STOP ONLY when:
-     - Next top-level number appears (e.g., "3.", "4.")
-     - Section divider
-     - End of page
-
-RULE 5 - COMBINE RULE (TWO QUESTIONS UNDER ONE NUMBER):
-IF multiple question sentences under SAME printed number
-AND no new printed number between them
-THEN combine into ONE question.
-
-================================================================================
-QUESTION TYPE DETECTION & PARSING
-================================================================================
-
-TYPE 1 - MULTIPLE CHOICE (question_type: "multiple_choice"):
-- Has lettered options: A) ... B) ... C) ... D) ...
-- Student circles or marks one option
-- Extract: question_text (include all options), student_answer (circled letter)
-
-TYPE 2 - TRUE/FALSE (question_type: "true_false"):
-- Question with True/False choices
-- Student circles one
-- Extract: question_text, student_answer ("True" or "False")
-
-TYPE 3 - FILL IN BLANK (question_type: "fill_blank"):
-⚠️ SPECIAL HANDLING for multiple blanks:
-
-Example: "The boy _____ at _____ with his _____."
-Student wrote: "is playing" "home" "dad" (in 3 blanks)
-
-CORRECT format:
-- question_text: "The boy _____ at _____ with his _____."
-- student_answer: "is playing | home | dad" (use | separator)
-
-IF multiple blanks:
-- Keep question_text with _____ markers
-- Combine ALL answers with " | " separator in ORDER
-
-TYPE 4 - SHORT ANSWER (question_type: "short_answer"):
-- Brief written response (1-3 sentences)
-- Extract exactly as written
-
-TYPE 5 - LONG ANSWER (question_type: "long_answer"):
-- Extended response (paragraph+)
-- Extract full text
+For parent questions with sub-items use:
+{{
+  "id": "<question number>",
+  "question_number": "<question number>",
+  "is_parent": true,
+  "has_subquestions": true,
+  "parent_content": "shared stem or instruction",
+  "subquestions": [
+    {{"id": "<question number>a", "question_text": "...", "student_answer": "...", "question_type": "short_answer", "need_image": false}}
+  ]
+}}
 
-================================================================================
-ANSWER EXTRACTION (CRITICAL)
-================================================================================
-- student_answer = EXACT handwriting (even if wrong)
-- Never calculate, infer, or correct
-- If unclear or cut off → set ""
-- For multi-blank: use " | " to separate (see TYPE 3 above)
-- For two-part question: label each answer with context
+RULES:
+1. Return EXACTLY {n} objects in "questions", in the SAME ORDER as listed above — ignore all other questions
+2. Extract EXACTLY what is written — do NOT paraphrase or translate
+3. PRESERVE the original language (Chinese stays Chinese, English stays English)
+4. For need_image: true if the question requires seeing a visual element to answer correctly (diagram, graph, chart, figure, table, shaded shape, fraction model, number line, clock face, grid, coin/money image, geometric figure, or any visual the student must observe). When in doubt, set true.
+   For parent questions with subquestions: if all subquestions share ONE diagram, set need_image=true on the PARENT ONLY (not on subquestions). If each subquestion has its OWN distinct visual, set need_image=true on those specific subquestions only. Never blindly copy need_image to all subquestions.
+5. For parent: extract ALL visible sub-items (a, b, c...) from the image
+6. student_answer is what the student wrote, NOT the correct answer
+7. Return valid JSON with no trailing commas"""
 
-MATHEMATICAL EXPRESSIONS:
-Use LaTeX for ALL mathematical formulas, symbols, and equations in question_text and student_answer.
-Example: use $\frac{{1}}{{2}}$ instead of 1/2, $x^2 + 3x = 0$ instead of x^2 + 3x = 0.
+        image_bytes = base64.b64decode(base64_image)
+        image_part = genai_types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")
 
-{subject_rules}
+        generation_config = genai_types.GenerateContentConfig(
+            temperature=0.0,
+            max_output_tokens=min(2048 * n, 16384),
+            candidate_count=1,
+            response_mime_type="application/json",
+        )
 
-================================================================================
-OUTPUT CHECKLIST
-================================================================================
-1. ✓ Scanned entire page?
-2. ✓ Used VISION FIRST (not limited by question text)?
-3. ✓ Extracted ALL visual markers (a, b, c, d...)?
-4. ✓ Correct question_type for each question?
-5. ✓ Multi-blank answers use " | " separator?
-6. ✓ total_questions = top-level questions only?
-7. ✓ Valid JSON with no markdown?
-"""
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=[image_part, genai_types.Part.from_text(text=prompt)],
+                config=generation_config
+            )
+            text = self._extract_response_text(response).strip()
+            if text.startswith("```"):
+                text = _RE_FENCED_BLOCK.match(text).group(1).strip()
+            result = _json_loads(text)
+            questions = result.get("questions", []) if isinstance(result, dict) else result
+            if not isinstance(questions, list):
+                questions = []
+            _intern_question_ids(questions)
+            if len(questions) != n:
+                logger.info("⚠️ reparse_questions_batch: requested %d questions, got %d", n, len(questions))
+            return {"questions": questions}
+        except Exception as e:
+            logger.error("reparse_questions_batch failed for Q%s: %s", ','.join(question_numbers), e)
+            raise
 
-        # Combine base prompt with subject-specific rules
-        # If subject_rules is empty (General/unknown), it won't add anything
-        prompt = base_prompt.format(subject_rules=subject_rules)
+    def _build_parse_prompt(self, subject: Optional[str] = None, multi_page: bool = False) -> str:
+        """
+        Build homework parsing prompt with optional subject-specific rules.
 
-        # Multi-page only: inject pageNumber into schema and field rules
-        if multi_page:
-            prompt = prompt.replace(
-                '      "question_number": "1",\n      "is_parent": true,',
-                '      "question_number": "1",\n      "pageNumber": 1,\n      "is_parent": true,'
-            )
-            prompt = prompt.replace(
-                '      "question_number": "2",\n      "question_text":',
-                '      "question_number": "2",\n      "pageNumber": 1,\n      "question_text":'
-            )
-            prompt = prompt.replace(
-                "- id: ALWAYS string.",
-                "- pageNumber: Integer. Which page (image) this top-level question appears on (1-based). "
-                "Use the image index where the question physically appears: first image → 1, second image → 2, etc.\n"
-                "- id: ALWAYS string."
-            )
+        Args:
+            subject: Subject name (e.g., "Math", "Physics", "English")
+                    If None or "General", uses universal rules only
+            multi_page: When True, adds pageNumber field to schema (multi-page batch only)
 
-        return prompt
+        Returns:
+            Complete parsing prompt combining base rules + subject rules
+        """
+        return _build_parse_prompt_cached((subject or "General").strip(), multi_page)
 
     def _build_grading_prompt(
         self,
@@ -1521,8 +1718,6 @@ OUTPUT CHECKLIST
         Uses the new grading_prompts module for specialized instructions based on
         question type and subject combinations (91 total combinations).
         """
-        from src.services.grading_prompts import build_complete_grading_prompt
-
         # Use the new prompt builder with type × subject specialization
         return build_complete_grading_prompt(
             question_type=question_type,
@@ -1537,158 +1732,97 @@ OUTPUT CHECKLIST
         )
 
     def _normalize_answer(self, answer: str) -> str:
-        """
-        Normalize an answer string for comparison across all question types.
-
-        Handles:
-        - Multiple choice option prefix removal (A., B., a), etc.)
-        - True/False abbreviations (T/F → true/false)
-        - Mathematical expressions (spacing, operators)
-        - Fractions and unicode symbols (½ → 1/2)
-        - Units normalization (5 km → 5km)
-        - Filler phrase removal ("the answer is", etc.)
-        - Whitespace and case normalization
-        - LaTeX math delimiters
+        """Normalize an answer string for comparison (see answer_normalize.normalize_answer)."""
+        return normalize_answer(answer)
 
-        Args:
-            answer: Raw answer string to normalize
-
-        Returns:
-            Normalized string for comparison
-        """
-        import re
-
-        if not answer:
-            return ""
-
-        # Step 1: Trim whitespace
-        normalized = answer.strip()
-
-        # Step 2: Remove multiple choice option prefixes (BEFORE lowercasing)
-        # Patterns: "A.", "A)", "(A)", "a.", "a)", "(a)", etc.
-        # This fixes bug where "A.x=1" was marked wrong when correct answer is "x=1"
-        normalized = re.sub(r'^[(]?[A-Za-z][.)\]]?\s*', '', normalized)
-
-        # Step 3: Lowercase for case-insensitive comparison
-        normalized = normalized.lower()
-
-        # Step 4: True/False normalization - expand abbreviations
-        # "t" → "true", "f" → "false" (after lowercasing)
-        if normalized == "t":
-            normalized = "true"
-        elif normalized == "f":
-            normalized = "false"
-
-        # Step 5: Remove common filler words and phrases
-        filler_phrases = ["the answer is", "answer:", "result:", "solution:", "equals"]
-        for phrase in filler_phrases:
-            normalized = normalized.replace(phrase, "")
-
-        # Step 6: Normalize mathematical expressions - remove spaces around operators
-        normalized = normalized.replace(" + ", "+")
-        normalized = normalized.replace(" - ", "-")
-        normalized = normalized.replace(" * ", "*")
-        normalized = normalized.replace(" / ", "/")
-        normalized = normalized.replace(" = ", "=")
-
-        # Step 7: Normalize fractions and unicode symbols
-        fraction_map = {
-            "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4",
-            "⅕": "1/5", "⅖": "2/5", "⅗": "3/5", "⅘": "4/5", "⅙": "1/6", "⅚": "5/6",
-            "⅛": "1/8", "⅜": "3/8", "⅝": "5/8", "⅞": "7/8"
-        }
-        for unicode_char, fraction in fraction_map.items():
-            normalized = normalized.replace(unicode_char, fraction)
-
-        # Step 8: Normalize units - remove spaces between number and unit
-        # "5 km" → "5km", "10 m/s" → "10m/s"
-        normalized = re.sub(r'(\d)\s+(km|m|cm|mm|kg|g|mg|l|ml|s|min|h|mph|km/h|m/s|°c|°f)', r'\1\2', normalized, flags=re.IGNORECASE)
-
-        # Step 9: Remove LaTeX math delimiters for comparison
-        # Remove \( ... \) and \[ ... \] delimiters
-        normalized = re.sub(r'\\\[|\\\]|\\\(|\\\)', '', normalized)
-
-        # Step 10: Collapse multiple spaces and newlines into single spaces
-        normalized = re.sub(r'\s+', ' ', normalized)
-
-        # Step 11: Final trim
-        return normalized.strip()
+    def _answers_equal(self, a: str, b: str) -> bool:
+        """True if two answers match after normalization (identical strings skip normalizing)."""
+        return answers_equal(a, b)
 
     def _extract_json_from_response(self, response_text: str) -> Dict[str, Any]:
         """Extract JSON from Gemini response (may include markdown or labeled format)."""
 
-        import re
-
-        # Remove markdown code blocks
-        cleaned = re.sub(r'```json\n?', '', response_text)
-        cleaned = re.sub(r'```\n?', '', cleaned)
-
-        # Try to extract JSON object (standard format)
-        json_match = re.search(r'\{.*\}', cleaned, re.DOTALL)
-        if json_match:
-            raw_json_str = json_match.group()
+        # Remove markdown code blocks — the common case is a single leading
+        # ```json / trailing ``` pair, which is sliced off without a regex scan
+        cleaned = response_text.strip()
+        if cleaned.startswith('```'):
+            cleaned = cleaned[3:]
+            if cleaned.startswith('json'):
+                cleaned = cleaned[4:]
+            if cleaned.endswith('```'):
+                cleaned = cleaned[:-3]
+        elif '```' in cleaned:
+            cleaned = _RE_JSON_CODEFENCE.sub('', cleaned)
+            cleaned = _RE_CODEFENCE.sub('', cleaned)
+
+        # Try to decode the JSON object in place (standard format) — raw_decode
+        # parses from the first '{' and ignores any trailing prose
+        start = cleaned.find('{')
+        if start != -1:
             try:
-                return json.loads(raw_json_str)
+                return _JSON_DECODER.raw_decode(cleaned, start)[0]
             except json.JSONDecodeError as e:
-                logger.info(f"⚠️ JSON parse error (attempt 1): {e} — trying LaTeX repair")
+                logger.info("⚠️ JSON parse error (attempt 1): %s — trying LaTeX repair", e)
                 # Retry with LaTeX backslash repair (handles gemini-3-flash-preview
                 # which sometimes outputs \sin, \theta etc. unescaped even in JSON mode)
-                try:
-                    repaired = self._repair_latex_json(raw_json_str)
-                    return json.loads(repaired)
-                except json.JSONDecodeError as e2:
-                    logger.info(f"⚠️ JSON parse error (attempt 2, after LaTeX repair): {e2}")
-                    logger.info(f"📄 Raw JSON snippet: {raw_json_str[:300]}")
-                    # Fall through to labeled format parser
+                raw_json_str = _find_json_object(cleaned)
+                if raw_json_str:
+                    try:
+                        repaired = self._repair_latex_json(raw_json_str)
+                        return _json_loads(repaired)
+                    except json.JSONDecodeError as e2:
+                        logger.info("⚠️ JSON parse error (attempt 2, after LaTeX repair): %s", e2)
+                        logger.info("📄 Raw JSON snippet: %s", raw_json_str[:300])
+                # Fall through to labeled format parser
 
         # FALLBACK: Parse labeled text format (SCORE: 1.0, IS_CORRECT: true, etc.)
         # This handles cases where Gemini returns labeled text instead of JSON
-        logger.debug(f"⚠️ No valid JSON found, trying labeled format parser...")
+        logger.debug("⚠️ No valid JSON found, trying labeled format parser...")
 
         try:
             result = {}
 
             # Extract SCORE
-            score_match = re.search(r'SCORE:\s*([\d.]+)', response_text, re.IGNORECASE)
+            score_match = _RE_SCORE.search(response_text)
             if score_match:
                 result['score'] = float(score_match.group(1))
             else:
                 result['score'] = 0.0
 
             # Extract IS_CORRECT
-            is_correct_match = re.search(r'IS_CORRECT:\s*(true|false)', response_text, re.IGNORECASE)
+            is_correct_match = _RE_IS_CORRECT.search(response_text)
             if is_correct_match:
                 result['is_correct'] = is_correct_match.group(1).lower() == 'true'
             else:
                 result['is_correct'] = result['score'] >= 0.9
 
             # Extract FEEDBACK
-            feedback_match = re.search(r'FEEDBACK:\s*(.+?)(?=\n(?:CONFIDENCE|CORRECT_ANSWER)|$)', response_text, re.IGNORECASE | re.DOTALL)
+            feedback_match = _RE_FEEDBACK.search(response_text)
             if feedback_match:
                 result['feedback'] = feedback_match.group(1).strip()
             else:
                 result['feedback'] = ""
 
             # Extract CONFIDENCE
-            confidence_match = re.search(r'CONFIDENCE:\s*([\d.]+)', response_text, re.IGNORECASE)
+            confidence_match = _RE_CONFIDENCE.search(response_text)
             if confidence_match:
                 result['confidence'] = float(confidence_match.group(1))
             else:
                 result['confidence'] = 0.8
 
             # Extract CORRECT_ANSWER
-            correct_answer_match = re.search(r'CORRECT_ANSWER:\s*(.+?)(?=$)', response_text, re.IGNORECASE | re.DOTALL)
+            correct_answer_match = _RE_CORRECT_ANSWER.search(response_text)
             if correct_answer_match:
                 result['correct_answer'] = correct_answer_match.group(1).strip()
             else:
                 result['correct_answer'] = ""
 
-            logger.debug(f"✅ Parsed labeled format: score={result.get('score')}, is_correct={result.get('is_correct')}")
+            logger.debug("✅ Parsed labeled format: score=%s, is_correct=%s", result.get('score'), result.get('is_correct'))
             return result
 
         except Exception as e:
-            logger.debug(f"❌ Labeled format parsing failed: {e}")
-            logger.debug(f"📄 Raw text: {response_text[:500]}")
+            logger.debug("❌ Labeled format parsing failed: %s", e)
+            logger.debug("📄 Raw text: %s", response_text[:500])
             raise Exception(f"No JSON or valid labeled format found in response: {response_text[:500]}")
 
 
@@ -7,12 +7,24 @@ Generates specialized grading instructions for all combinations of:
 - 13 Subjects: Math, Science, English, History, Geography, Physics, Chemistry, Biology, Computer Science, Foreign Language, Art, Music, Physical Education
 
 Total: 91 possible combinations with unique grading criteria
+
+All tables are fully type-annotated str → str dicts and the module has no
+service dependencies besides prompt_i18n (plain data), so both can be
+compiled with mypyc:
+
+    mypyc src/services/grading_prompts.py src/services/prompt_i18n.py
+
+The compiled extensions are picked up automatically in place of the .py
+files; the pure-Python versions remain the fallback.
 """
 
-from typing import Optional
+import functools
+from typing import Dict, List, Optional
+
+from .prompt_i18n import GRADING_FEEDBACK_LANG_INSTRUCTION_BY_ALIAS
 
 # Question type definitions
-QUESTION_TYPES = [
+QUESTION_TYPES: List[str] = [
     "multiple_choice",
     "true_false",
     "fill_blank",
@@ -24,7 +36,7 @@ QUESTION_TYPES = [
 ]
 
 # Subject definitions (matching iOS Subject enum)
-SUBJECTS = [
+SUBJECTS: List[str] = [
     "Math",
     "Science",
     "English",
@@ -53,40 +65,46 @@ def get_grading_instructions(question_type: Optional[str], subject: Optional[str
         Specialized grading instructions as a string
     """
 
-    # Normalize inputs
-    q_type = (question_type or "unknown").lower()
-    subj = (subject or "General").strip()
+    # No type and no subject: nothing to specialize on
+    if not question_type and not subject:
+        return _GENERIC_INSTRUCTIONS
 
-    # Build specialized instructions
-    instructions = []
+    # Normalize inputs — table keys are lowercase, so "Math", "math" and
+    # " MATH " all resolve to the same rules
+    q_type = (question_type or "unknown").strip().lower()
+    subj = (subject or "general").strip().lower()
 
-    # TYPE-SPECIFIC INSTRUCTIONS
-    type_instructions = _get_type_specific_instructions(q_type)
-    if type_instructions:
-        instructions.append(type_instructions)
+    return get_grading_instructions_normalized(q_type, subj)
 
-    # SUBJECT-SPECIFIC INSTRUCTIONS
-    subject_instructions = _get_subject_specific_instructions(subj)
-    if subject_instructions:
-        instructions.append(subject_instructions)
 
-    # COMBINED TYPE × SUBJECT INSTRUCTIONS
-    combined_instructions = _get_combined_instructions(q_type, subj)
-    if combined_instructions:
-        instructions.append(combined_instructions)
+def get_grading_instructions_normalized(q_type: str, subj: str) -> str:
+    """
+    Grading instructions for an already-normalized (question_type, subject) pair.
 
-    # Join all instructions
-    if instructions:
-        return "\n\n".join(instructions)
-    else:
-        return _get_generic_instructions()
+    For callers that normalize once at the request boundary: both keys must be
+    stripped and lowercased ("unknown" / "general" when absent). Skips the
+    per-call normalization done by get_grading_instructions.
+    """
+    # Known pairs are pre-joined at import; anything else goes through the LRU
+    return _PRECOMPUTED.get(q_type + "|" + subj) or _cached_instructions(q_type, subj)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_instructions(q_type: str, subj: str) -> str:
+    """Join type, subject and combined instructions for normalized keys (memoized)."""
 
+    # Type-specific, subject-specific and combined type × subject rules, probed
+    # directly from the three tables; empty sections are skipped
+    instructions = "\n\n".join(filter(None, (
+        _TYPE_PROMPTS.get(q_type),
+        _SUBJECT_PROMPTS.get(subj),
+        _COMBINATIONS.get(q_type + "|" + subj),
+    )))
+    return instructions or _GENERIC_INSTRUCTIONS
 
-def _get_type_specific_instructions(question_type: str) -> str:
-    """Get instructions specific to question type."""
 
-    type_prompts = {
-        "multiple_choice": """
+# --- Question type rules ---
+_MC_RULES = """
 📋 MULTIPLE CHOICE GRADING RULES:
 
 STEP 1 — Detect question variant:
@@ -111,17 +129,17 @@ STEP 3 — Scoring:
               correct=BCD, student selects B,A → score 0.0 (1 hit, 1 wrong → penalised)
               correct=BCD, student selects B,C,D → score 1.0 (perfect)
 - is_correct = true only when score >= 0.9.
-""",
+"""
 
-        "true_false": """
+_TF_RULES = """
 📋 TRUE/FALSE GRADING RULES:
 - correct_answer is exactly "True" or "False"
 - student_answer is exactly "True" or "False"
 - Compare directly (case-insensitive): "true" == "true" → correct, else incorrect
 - All-or-nothing scoring
-""",
+"""
 
-        "fill_blank": """
+_FILL_BLANK_RULES = """
 📋 FILL-IN-THE-BLANK GRADING RULES:
 - Multiple blanks may be separated by | or numbered
 - Each blank must be graded independently
@@ -130,9 +148,9 @@ STEP 3 — Scoring:
 - Articles (a, an, the): Usually optional in science/math, CRITICAL in English/Foreign Language
 - Plural vs singular matters in most subjects
 - Give partial credit for partially correct multi-blank answers
-""",
+"""
 
-        "short_answer": """
+_SHORT_ANSWER_RULES = """
 📋 SHORT ANSWER GRADING RULES:
 - Answer should be 1-3 sentences or a brief phrase
 - Focus on key concepts, not exact wording
@@ -140,9 +158,9 @@ STEP 3 — Scoring:
 - Minor grammar/spelling errors acceptable if meaning is clear
 - Partial credit for incomplete but directionally correct answers
 - Must demonstrate understanding of the core concept
-""",
+"""
 
-        "long_answer": """
+_LONG_ANSWER_RULES = """
 📋 LONG ANSWER GRADING RULES:
 - Evaluate completeness, accuracy, and organization
 - Look for: thesis/main point, supporting evidence, logical flow
@@ -150,9 +168,9 @@ STEP 3 — Scoring:
 - Grammar and spelling should not dominate grading unless critical to meaning
 - Value quality over quantity
 - Check for: addressing all parts of the question, use of examples
-""",
+"""
 
-        "calculation": """
+_CALCULATION_RULES = """
 📋 CALCULATION GRADING RULES:
 - Final answer AND process both matter
 - General partial credit breakdown (use subject-specific if available):
@@ -164,9 +182,9 @@ STEP 3 — Scoring:
 - Show work is important for complex problems requiring multiple steps or formulas
 - For simple single-operation arithmetic, correct answer demonstrates understanding
 - Accept equivalent forms (fractions = decimals = percentages)
-""",
+"""
 
-        "matching": """
+_MATCHING_RULES = """
 📋 MATCHING GRADING RULES:
 - Each pair must match correctly (all-or-nothing per pair)
 - Common formats: 1-A, 2-B or using arrows/lines
@@ -174,9 +192,9 @@ STEP 3 — Scoring:
 - Partial credit: award points per correct match (e.g., 5 matches = 0.2 points each)
 - Do not penalize for format differences if intention is clear
 - Look for: swapped answers, one correct match affecting others
-""",
+"""
 
-        "composition": """
+_COMPOSITION_RULES = """
 📋 COMPOSITION / ESSAY GRADING RULES:
 - This is a WRITING assignment (essay, paragraph, story, 作文), NOT a factual Q&A.
 - DO NOT grade as simply right/wrong. Grade on writing quality.
@@ -222,25 +240,32 @@ FEEDBACK REQUIREMENTS:
 - Keep feedback encouraging and constructive (50-100 words)
 - correct_answer field: return empty string "" (compositions have no single correct answer)
 """
-    }
 
-    return type_prompts.get(question_type, "")
 
+# Question type → grading rules (built once at import)
+_TYPE_PROMPTS: Dict[str, str] = {
+    "multiple_choice": _MC_RULES,
+    "true_false": _TF_RULES,
+    "fill_blank": _FILL_BLANK_RULES,
+    "short_answer": _SHORT_ANSWER_RULES,
+    "long_answer": _LONG_ANSWER_RULES,
+    "calculation": _CALCULATION_RULES,
+    "matching": _MATCHING_RULES,
+    "composition": _COMPOSITION_RULES,
+}
 
-def _get_subject_specific_instructions(subject: str) -> str:
-    """Get instructions specific to subject area."""
 
-    subject_prompts = {
-        "Math": """
+# --- Subject rules ---
+_MATH_RULES = """
 🔢 MATH SUBJECT RULES:
 - Precision: Accept equivalent forms (½ = 0.5 = 50%)
 - Show work: Partial credit heavily weighted on process
 - Common errors: sign errors, order of operations, unit conversion
 - Accept multiple solution methods if result is correct
 - Variables: x and X are the same in most contexts
-""",
+"""
 
-        "Physics": """
+_PHYSICS_RULES = """
 ⚛️ PHYSICS SUBJECT RULES:
 - Units are CRITICAL: 10m/s ≠ 10m/s²
 - Significant figures: Match question's precision
@@ -248,9 +273,9 @@ def _get_subject_specific_instructions(subject: str) -> str:
 - Check dimensional analysis: [Force] = mass × acceleration
 - Accept g = 9.8 m/s² or 10 m/s² unless specified
 - Vector notation: magnitude and direction both required
-""",
+"""
 
-        "Chemistry": """
+_CHEMISTRY_RULES = """
 🧪 CHEMISTRY SUBJECT RULES:
 - Chemical formulas: Accept both H2O and H₂O (subscripts not required for digital homework)
 - Balancing equations: coefficients must be lowest whole numbers
@@ -259,18 +284,18 @@ def _get_subject_specific_instructions(subject: str) -> str:
 - Significant figures follow multiplication/division rules
 - Accept IUPAC names and common names
 - Ion charges: Must be correct (Fe²⁺ ≠ Fe³⁺), accept Fe2+ and Fe^2+
-""",
+"""
 
-        "Biology": """
+_BIOLOGY_RULES = """
 🌱 BIOLOGY SUBJECT RULES:
 - Scientific names: Genus species (italics/underline not required in handwriting)
 - Spelling: Accept phonetic spellings for complex terms if recognizable
 - Diagrams: Label accuracy more important than artistic quality
 - Processes: Order/sequence of steps matters
 - Accept both common and scientific terminology
-""",
+"""
 
-        "English": """
+_ENGLISH_RULES = """
 📚 ENGLISH SUBJECT RULES:
 - Grammar: Minor errors acceptable if meaning is preserved
 - Spelling: Accept British vs American spellings
@@ -278,54 +303,54 @@ def _get_subject_specific_instructions(subject: str) -> str:
 - Citations: Format less important than including author/title
 - Essay structure: Introduction, body, conclusion expected
 - Voice: First person acceptable unless specified otherwise
-""",
+"""
 
-        "Foreign Language": """
+_FOREIGN_LANGUAGE_RULES = """
 🌍 FOREIGN LANGUAGE SUBJECT RULES:
 - Accent marks: Important for meaning but partial credit if only mark is wrong
 - Gender/articles: Critical in gendered languages (le/la, el/la, der/die/das)
 - Verb conjugation: Tense and person must match
 - Word order: Matters more in some languages (German, Japanese) than others
 - Accept regional variations (Latin American vs European Spanish)
-""",
+"""
 
-        "History": """
+_HISTORY_RULES = """
 🏛️ HISTORY SUBJECT RULES:
 - Dates: Year correct more important than exact day/month (unless specified)
 - Names: Accept phonetic spellings of historical figures
 - Events: Causation and significance matter more than memorization
 - Multiple perspectives: Accept different valid interpretations
 - Primary sources: Direct quotes more valuable than paraphrasing
-""",
+"""
 
-        "Geography": """
+_GEOGRAPHY_RULES = """
 🌏 GEOGRAPHY SUBJECT RULES:
 - Locations: Spelling variations acceptable for place names
 - Maps: Approximate locations acceptable if clearly in correct region
 - Climate/biomes: Accept multiple classification systems
 - Coordinates: Latitude/longitude precision to nearest degree usually sufficient
 - Capitals: Current names (not historical) unless context requires
-""",
+"""
 
-        "Science": """
+_SCIENCE_RULES = """
 🔬 GENERAL SCIENCE SUBJECT RULES:
 - Scientific method: Hypothesis, experiment, conclusion structure
 - Observations vs inferences: Distinguish between the two
 - Units: Metric system preferred unless specified
 - Diagrams: Clear labels more important than artistic detail
 - Variables: Independent, dependent, controlled must be identified correctly
-""",
+"""
 
-        "Computer Science": """
+_CS_RULES = """
 💻 COMPUTER SCIENCE SUBJECT RULES:
 - Syntax: Minor syntax errors acceptable if logic is correct
 - Pseudocode: Focus on algorithm logic, not exact syntax
 - Time complexity: O(n), O(n²) notation must be exact
 - Code tracing: Each step must be traceable and correct
 - Boolean logic: Truth tables must be complete and accurate
-""",
+"""
 
-        "Art": """
+_ART_RULES = """
 🎨 ART SUBJECT RULES:
 - Terminology: Accept variations in art historical terms
 - Analysis: Multiple interpretations valid if supported by evidence
@@ -333,18 +358,18 @@ def _get_subject_specific_instructions(subject: str) -> str:
 - Art movements: Accept date ranges with ±5 year tolerance (some movements were brief)
 - Artist names: Accept phonetic spellings if recognizable
 - Color theory: Primary, secondary, tertiary color identification must be accurate
-""",
+"""
 
-        "Music": """
+_MUSIC_RULES = """
 🎵 MUSIC SUBJECT RULES:
 - Note names: Accept both letter names (C, D, E) and solfège (Do, Re, Mi)
 - Rhythm: Accept multiple notation systems
 - Key signatures: Sharps and flats must match exactly
 - Terms: Accept both Italian and English musical terms
 - Listening identification: Accept close approximations for tempo/dynamics
-""",
+"""
 
-        "Physical Education": """
+_PE_RULES = """
 🏃 PHYSICAL EDUCATION SUBJECT RULES:
 - Terminology: Accept common names and technical terms
 - Safety: Safety protocols must be correct (no partial credit)
@@ -352,28 +377,36 @@ def _get_subject_specific_instructions(subject: str) -> str:
 - Biomechanics: Accept descriptive answers if mechanically sound
 - Health: Distinguish facts from common misconceptions
 """
-    }
-
-    return subject_prompts.get(subject, "")
 
 
-def _get_combined_instructions(question_type: str, subject: str) -> str:
-    """
-    Get instructions for specific type × subject combinations.
-    This handles special cases where type and subject interact.
-    """
-
-    # Key combinations that need special handling
-    combinations = {
-        ("multiple_choice", "Math"): """
+# Subject (lowercased) → grading rules
+_SUBJECT_PROMPTS: Dict[str, str] = {
+    "math": _MATH_RULES,
+    "physics": _PHYSICS_RULES,
+    "chemistry": _CHEMISTRY_RULES,
+    "biology": _BIOLOGY_RULES,
+    "english": _ENGLISH_RULES,
+    "foreign language": _FOREIGN_LANGUAGE_RULES,
+    "history": _HISTORY_RULES,
+    "geography": _GEOGRAPHY_RULES,
+    "science": _SCIENCE_RULES,
+    "computer science": _CS_RULES,
+    "art": _ART_RULES,
+    "music": _MUSIC_RULES,
+    "physical education": _PE_RULES,
+}
+
+
+# --- Type × subject combination rules ---
+_MC_MATH_RULES = """
 🎯 MULTIPLE CHOICE × MATH COMBINATION:
 - Check mathematical equivalence: 1/2 in option A = 0.5 in option B
 - Watch for: different forms of same answer (simplified vs unsimplified)
 - Calculator precision: answers may differ in trailing decimals
 - Accept selection by letter OR by writing the equivalent numerical value
-""",
+"""
 
-        ("calculation", "Physics"): """
+_CALCULATION_PHYSICS_RULES = """
 🎯 CALCULATION × PHYSICS COMBINATION:
 - Formula selection is critical: Wrong formula = maximum 30% credit
 - Unit conversion: Often embedded in problem (km/h → m/s, degrees to radians)
@@ -385,9 +418,9 @@ def _get_combined_instructions(question_type: str, subject: str) -> str:
   * Final answer with correct units: 20%
 - Accept g = 9.8 m/s² or 10 m/s² unless problem specifies
 - Significant figures: Usually 2-3 sig figs unless problem specifies more
-""",
+"""
 
-        ("calculation", "Chemistry"): """
+_CALCULATION_CHEMISTRY_RULES = """
 🎯 CALCULATION × CHEMISTRY COMBINATION:
 - Stoichiometry: Mole ratios from balanced equation must be correct
 - Unit awareness: grams, moles, liters, molarity - all conversions matter
@@ -399,53 +432,53 @@ def _get_combined_instructions(question_type: str, subject: str) -> str:
   * Answer with correct units and sig figs: 20%
 - Accept both systematic and common chemical names
 - Empirical vs molecular formula: Must distinguish when asked
-""",
+"""
 
-        ("fill_blank", "English"): """
+_FILL_BLANK_ENGLISH_RULES = """
 🎯 FILL BLANK × ENGLISH COMBINATION:
 - Grammar context: Verb tense, number agreement critical
 - Articles: "a" vs "an" vs "the" matters
 - Capitalization: Proper nouns must be capitalized
 - Accept synonyms if grammatically correct in context
 - Spelling: Minor errors acceptable if word is recognizable
-""",
+"""
 
-        ("fill_blank", "Foreign Language"): """
+_FILL_BLANK_FOREIGN_LANGUAGE_RULES = """
 🎯 FILL BLANK × FOREIGN LANGUAGE COMBINATION:
 - Gender agreement: Article and adjective must match noun gender
 - Verb conjugation: Person and tense must be correct for context
 - Accent marks: Important but partial credit if only accent is wrong
 - Case endings: Critical in languages with case systems (German, Russian)
 - Word order: Must match target language syntax
-""",
+"""
 
-        ("short_answer", "History"): """
+_SHORT_ANSWER_HISTORY_RULES = """
 🎯 SHORT ANSWER × HISTORY COMBINATION:
 - Dates: Year is more important than exact date
 - Multiple causes: Accept any major cause as correct
 - Perspective: Different valid historical interpretations exist
 - Key terms: Proper nouns should be recognizable even if misspelled
 - Causation: Look for understanding of cause-and-effect relationships
-""",
+"""
 
-        ("long_answer", "English"): """
+_LONG_ANSWER_ENGLISH_RULES = """
 🎯 LONG ANSWER × ENGLISH COMBINATION:
 - Thesis statement: Must be present and clear (20% of grade)
 - Evidence: Specific examples from text (30% of grade)
 - Analysis: Explanation of how evidence supports thesis (30% of grade)
 - Organization: Introduction, body paragraphs, conclusion (10% of grade)
 - Grammar/mechanics: Only major errors that impede understanding (10% of grade)
-""",
+"""
 
-        ("true_false", "Science"): """
+_TF_SCIENCE_RULES = """
 🎯 TRUE/FALSE × SCIENCE COMBINATION:
 - Watch for: "always," "never," "sometimes" qualifiers
 - Scientific accuracy: Statements must be completely true or false
 - Common traps: Mixing correct and incorrect information in one statement
 - If justification required: Must cite scientific principle or evidence
-""",
+"""
 
-        ("calculation", "Math"): """
+_CALCULATION_MATH_RULES = """
 🎯 CALCULATION × MATH COMBINATION:
 - Accept multiple solution methods (algebraic, graphical, numerical)
 - Notation: π is acceptable for answers, exact vs decimal specified in problem
@@ -457,45 +490,45 @@ def _get_combined_instructions(question_type: str, subject: str) -> str:
 - Common errors: Sign errors, distributing negatives, order of operations
 - Award full credit for correct answers to basic arithmetic operations
 - For complex multi-step problems, work shown is necessary for full credit
-""",
+"""
 
-        ("short_answer", "Science"): """
+_SHORT_ANSWER_SCIENCE_RULES = """
 🎯 SHORT ANSWER × SCIENCE COMBINATION:
 - Lab safety questions: Must be 100% correct (no partial credit for safety violations)
 - Experimental design: Must identify independent/dependent/controlled variables correctly
 - Accept scientific terminology or clear descriptions of concepts
 - Hypothesis format: If/Then statements preferred but not required
 - Units required for any numerical answer
-""",
+"""
 
-        ("fill_blank", "Math"): """
+_FILL_BLANK_MATH_RULES = """
 🎯 FILL BLANK × MATH COMBINATION:
 - Mathematical notation matters: √ vs sqrt, × vs *, π vs 3.14
 - Variables: Case sensitive if problem uses both x and X differently
 - Accept equivalent expressions: 2x vs x+x vs x*2
 - Fractions: Accept 1/2, ½, 0.5 as equivalent unless form is specified
 - Negative signs: -5 ≠ 5, careful with placement
-""",
+"""
 
-        ("multiple_choice", "Science"): """
+_MC_SCIENCE_RULES = """
 🎯 MULTIPLE CHOICE × SCIENCE COMBINATION:
 - Units in answer choices help eliminate wrong answers
 - "All of the above" / "None of the above": Check ALL other options first
 - Order of magnitude: 100m vs 100km - students often confuse
 - Scientific notation: 1.5 × 10³ vs 1500 - accept if student chooses equivalent
 - Diagram-based questions: Verify student is referencing correct part
-""",
+"""
 
-        ("composition", "English"): """
+_COMPOSITION_ENGLISH_RULES = """
 🎯 COMPOSITION × ENGLISH COMBINATION:
 - Evaluate against grade-level writing standards
 - Grammar weight is higher (25%) — correct sentence structure, tense consistency, and punctuation are critical
 - Look for: thesis statement, topic sentences, concluding sentence
 - Literary devices (simile, metaphor) are a bonus, not required
 - Spelling errors: deduct more heavily than in other subjects
-""",
+"""
 
-        ("composition", "Foreign Language"): """
+_COMPOSITION_FOREIGN_LANGUAGE_RULES = """
 🎯 COMPOSITION × FOREIGN LANGUAGE COMBINATION:
 - Evaluate relative to the student's learning level (be more lenient on advanced grammar)
 - Vocabulary range and correct usage is more important than grammatical perfection
@@ -503,16 +536,30 @@ def _get_combined_instructions(question_type: str, subject: str) -> str:
 - Accept L1 influence in phrasing if meaning is clear and task doesn't forbid it
 - Accent marks/diacritics: partial credit if only mark is wrong but word is correct
 """
-    }
-
-    key = (question_type, subject)
-    return combinations.get(key, "")
-
 
-def _get_generic_instructions() -> str:
-    """Fallback generic grading instructions when type/subject unknown."""
 
-    return """
+# Key type × subject combinations that need special handling, keyed by the
+# flat lowercase string "question_type|subject" (one str hash per lookup)
+_COMBINATIONS: Dict[str, str] = {
+    "multiple_choice|math": _MC_MATH_RULES,
+    "calculation|physics": _CALCULATION_PHYSICS_RULES,
+    "calculation|chemistry": _CALCULATION_CHEMISTRY_RULES,
+    "fill_blank|english": _FILL_BLANK_ENGLISH_RULES,
+    "fill_blank|foreign language": _FILL_BLANK_FOREIGN_LANGUAGE_RULES,
+    "short_answer|history": _SHORT_ANSWER_HISTORY_RULES,
+    "long_answer|english": _LONG_ANSWER_ENGLISH_RULES,
+    "true_false|science": _TF_SCIENCE_RULES,
+    "calculation|math": _CALCULATION_MATH_RULES,
+    "short_answer|science": _SHORT_ANSWER_SCIENCE_RULES,
+    "fill_blank|math": _FILL_BLANK_MATH_RULES,
+    "multiple_choice|science": _MC_SCIENCE_RULES,
+    "composition|english": _COMPOSITION_ENGLISH_RULES,
+    "composition|foreign language": _COMPOSITION_FOREIGN_LANGUAGE_RULES,
+}
+
+
+# Fallback generic grading instructions when type/subject unknown
+_GENERIC_INSTRUCTIONS = """
 📋 GENERAL GRADING INSTRUCTIONS:
 - Evaluate both correctness and understanding
 - Award partial credit for partially correct answers
@@ -524,6 +571,76 @@ def _get_generic_instructions() -> str:
 """
 
 
+
+# Pre-joined instructions for every known "type|subject" key, including the
+# "unknown"/"general" defaults, so the common path is a single dict lookup.
+# Values stay str: both callers hand the prompt to an SDK (google-genai, openai)
+# that takes str and does its own JSON/UTF-8 encoding, so cached bytes would
+# never be used.
+_PRECOMPUTED: Dict[str, str] = {
+    q_type + "|" + subj: _cached_instructions.__wrapped__(q_type, subj)
+    for q_type in QUESTION_TYPES + ["unknown"]
+    for subj in [s.lower() for s in SUBJECTS] + ["general"]
+}
+
+
+# Static sections of the complete grading prompt (independent of the question,
+# reasoning mode and language, so they are module constants)
+_PROMPT_HEADER = """Grade the following student answer carefully and fairly.
+
+GRADING PRINCIPLES:
+- Be consistent: Apply the same standards to similar answers
+- Be educational: Focus on helping students learn from mistakes
+- Be fair: Award partial credit for partially correct work
+- Be specific: Point out exactly what was right or wrong
+- Be encouraging: Frame feedback constructively
+"""
+
+_OUTPUT_FORMAT = """
+EXACT MATCH RULE (check this FIRST, before applying partial-credit breakdowns):
+- If the student's answer is numerically or semantically equivalent to the correct answer → score = 1.0, is_correct = true.
+- "80" == "80", "0.5" == "1/2" == "50%", "Paris" == "paris" are all exact matches.
+- Do NOT penalize for missing work when the final answer is correct on a simple one-step problem.
+
+Assign a grade from 0.0 to 1.0:
+- 1.0 = Perfect, completely correct
+- 0.9 = Excellent, minor issue but substantially correct
+- 0.7-0.8 = Good, correct core understanding with some errors
+- 0.5-0.6 = Partial credit, some understanding but significant gaps
+- 0.3-0.4 = Poor, major misunderstanding but some relevant content
+- 0.0-0.2 = Incorrect, fundamental misunderstanding
+
+is_correct DEFINITION (strict rule — never deviate):
+- is_correct = true  when score >= 0.9
+- is_correct = false when score < 0.9
+
+FEEDBACK REQUIREMENT (mandatory, must not be empty):
+- If incorrect (score < 0.9): write 50-100 words explaining the specific error and guiding toward the correct understanding.
+- If correct (score >= 0.9): write under 50 words confirming what the student did well.
+
+MATH FORMATTING (this is JSON output — backslashes must be doubled):
+- Inline math: \\(expression\\) — e.g. \\(\\frac{3}{2}\\), \\(x^2\\), \\(\\text{mol}\\)
+- Display math: \\[expression\\]
+- NEVER use bare LaTeX commands or $ signs outside delimiters
+
+Return JSON with: score, is_correct, feedback, confidence, correct_answer
+"""
+
+
+# Preamble used when neither question type nor subject is known
+_GENERIC_PREAMBLE = f"{_PROMPT_HEADER}\n\n{_GENERIC_INSTRUCTIONS}\n\n"
+
+# Static prompt tail (output format + language instruction) specialized per
+# language at import. Output format is identical for fast and deep mode (quality
+# difference comes from the model, not the prompt), so language is the only axis.
+# Only the feedback field is localized; JSON keys stay English.
+_PROMPT_TAIL_DEFAULT = f"\n\n{_OUTPUT_FORMAT}"
+_PROMPT_TAILS: Dict[str, str] = {
+    alias: _PROMPT_TAIL_DEFAULT + ("\n\n" + instruction if instruction else "")
+    for alias, instruction in GRADING_FEEDBACK_LANG_INSTRUCTION_BY_ALIAS.items()
+}
+
+
 def build_complete_grading_prompt(
     question_type: Optional[str],
     subject: Optional[str],
@@ -552,99 +669,82 @@ def build_complete_grading_prompt(
         Complete formatted grading prompt
     """
 
-    # Get specialized instructions
-    specialized_instructions = get_grading_instructions(question_type, subject)
-
-    # Build prompt components
-    prompt_parts = []
+    # The prompt is <prefix><student answer><suffix>: everything except the
+    # student's answer depends only on the question, so both halves are
+    # memoized and a cohort answering the same question reuses them
+    prefix = _grading_prompt_prefix(question_type, subject, question_text, parent_content)
+    suffix = _grading_prompt_suffix(correct_answer, has_context_image, language)
+    return f"{prefix}{student_answer}{suffix}"
 
-    # Header (role description omitted — already set as system message in Responses API)
-    prompt_parts.append("""Grade the following student answer carefully and fairly.
 
-GRADING PRINCIPLES:
-- Be consistent: Apply the same standards to similar answers
-- Be educational: Focus on helping students learn from mistakes
-- Be fair: Award partial credit for partially correct work
-- Be specific: Point out exactly what was right or wrong
-- Be encouraging: Frame feedback constructively
-""")
-
-    # Question type and subject context
-    if question_type or subject:
-        context = []
-        if question_type:
-            context.append(f"Question Type: {question_type}")
-        if subject:
-            context.append(f"Subject: {subject}")
-        prompt_parts.append("\n".join(context))
-
-    # Specialized instructions
-    if specialized_instructions:
-        prompt_parts.append(specialized_instructions)
+@functools.lru_cache(maxsize=1024)
+def _grading_prompt_prefix(
+    question_type: Optional[str],
+    subject: Optional[str],
+    question_text: str,
+    parent_content: Optional[str]
+) -> str:
+    """Grading prompt up to and including the "STUDENT ANSWER: " label (memoized)."""
+
+    # Sections are assembled in one f-string below; optional sections carry
+    # their own "\n\n" separator so absent ones contribute nothing. (An
+    # io.StringIO writer was measured ~4x slower than the f-string for this
+    # 5-8 part, ~5KB prompt, so it is not used.)
+
+    # Header (role description omitted — already set as system message in Responses API),
+    # question type / subject context and specialized instructions
+    if not question_type and not subject:
+        # Nothing to specialize on — fully static preamble
+        preamble = _GENERIC_PREAMBLE
+    else:
+        # Specialized instructions, looked up inline (this function is already
+        # memoized); never empty — unknown pairs fall back to the generic block
+        q_type = (question_type or "unknown").strip().lower()
+        subj = (subject or "general").strip().lower()
+        specialized_instructions = (
+            _PRECOMPUTED.get(q_type + "|" + subj) or _cached_instructions(q_type, subj)
+        )
+
+        # Context lines — at most two, so pick the shape directly instead of
+        # building and joining a list
+        if question_type and subject:
+            context = f"Question Type: {question_type}\nSubject: {subject}"
+        elif question_type:
+            context = f"Question Type: {question_type}"
+        else:
+            context = f"Subject: {subject}"
+        preamble = f"{_PROMPT_HEADER}\n\n{context}\n\n{specialized_instructions}\n\n"
 
     # Parent question context (for subquestions)
+    parent = ""
     if parent_content:
-        prompt_parts.append(f"""
+        parent = f"""
 📚 PARENT QUESTION CONTEXT:
 This is a subquestion that belongs to a larger multi-part question.
 Parent Question: {parent_content}
 
 Consider the parent question's context when grading this subquestion.
-""")
-
-    # The actual grading task
-    grading_task = f"""
-QUESTION: {question_text}
-
-STUDENT ANSWER: {student_answer}
-"""
-
-    if correct_answer:
-        grading_task += f"\nCORRECT ANSWER: {correct_answer}"
+\n\n"""
 
-    if has_context_image:
-        grading_task += "\n\n📷 Note: This question includes an image for visual context."
-
-    prompt_parts.append(grading_task)
-
-    # Output format instructions — identical for both fast and deep mode
-    # (quality difference comes from the model, not the prompt)
-    output_format = """
-EXACT MATCH RULE (check this FIRST, before applying partial-credit breakdowns):
-- If the student's answer is numerically or semantically equivalent to the correct answer → score = 1.0, is_correct = true.
-- "80" == "80", "0.5" == "1/2" == "50%", "Paris" == "paris" are all exact matches.
-- Do NOT penalize for missing work when the final answer is correct on a simple one-step problem.
+    # The actual grading task (continued in the suffix after the student answer)
+    return f"{preamble}{parent}\nQUESTION: {question_text}\n\nSTUDENT ANSWER: "
 
-Assign a grade from 0.0 to 1.0:
-- 1.0 = Perfect, completely correct
-- 0.9 = Excellent, minor issue but substantially correct
-- 0.7-0.8 = Good, correct core understanding with some errors
-- 0.5-0.6 = Partial credit, some understanding but significant gaps
-- 0.3-0.4 = Poor, major misunderstanding but some relevant content
-- 0.0-0.2 = Incorrect, fundamental misunderstanding
 
-is_correct DEFINITION (strict rule — never deviate):
-- is_correct = true  when score >= 0.9
-- is_correct = false when score < 0.9
-
-FEEDBACK REQUIREMENT (mandatory, must not be empty):
-- If incorrect (score < 0.9): write 50-100 words explaining the specific error and guiding toward the correct understanding.
-- If correct (score >= 0.9): write under 50 words confirming what the student did well.
-
-MATH FORMATTING (this is JSON output — backslashes must be doubled):
-- Inline math: \\(expression\\) — e.g. \\(\\frac{3}{2}\\), \\(x^2\\), \\(\\text{mol}\\)
-- Display math: \\[expression\\]
-- NEVER use bare LaTeX commands or $ signs outside delimiters
-
-Return JSON with: score, is_correct, feedback, confidence, correct_answer
-"""
+@functools.lru_cache(maxsize=1024)
+def _grading_prompt_suffix(
+    correct_answer: Optional[str],
+    has_context_image: bool,
+    language: Optional[str]
+) -> str:
+    """Grading prompt after the student answer (memoized)."""
 
-    prompt_parts.append(output_format)
+    # Optional task lines are interpolated inline rather than appended with +=,
+    # which would copy the string each time
+    correct_line = f"\nCORRECT ANSWER: {correct_answer}" if correct_answer else ""
+    image_note = "\n\n📷 Note: This question includes an image for visual context." if has_context_image else ""
 
-    # Language instruction — only feedback field is localized, JSON keys stay English
-    from src.services.prompt_i18n import normalize_language, GRADING_FEEDBACK_LANG_INSTRUCTION
-    lang_instruction = GRADING_FEEDBACK_LANG_INSTRUCTION.get(normalize_language(language), "")
-    if lang_instruction:
-        prompt_parts.append(lang_instruction)
+    # Output format + language instruction, prebuilt per language; unknown or
+    # empty codes fall back to English (no language instruction)
+    tail = _PROMPT_TAILS.get(language.lower(), _PROMPT_TAIL_DEFAULT) if language else _PROMPT_TAIL_DEFAULT
 
-    return "\n\n".join(prompt_parts)
+    return f"\n{correct_line}{image_note}{tail}"
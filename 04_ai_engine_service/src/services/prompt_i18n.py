@@ -14,7 +14,7 @@ Backend question-generation-v2.js sends "zh-CN" / "zh-TW" — these are
 normalized to "zh-Hans" / "zh-Hant" at the AI Engine boundary (see normalize_language()).
 """
 
-from typing import Optional
+from typing import Dict, Optional
 
 
 # ---------------------------------------------------------------------------
@@ -22,7 +22,7 @@ from typing import Optional
 # Accepts both BCP-47 variants the backend may send and returns a canonical key.
 # ---------------------------------------------------------------------------
 
-_LANG_ALIASES = {
+_LANG_ALIASES: Dict[str, str] = {
     "zh-cn": "zh-Hans",
     "zh-hans": "zh-Hans",
     "zh-tw": "zh-Hant",
@@ -30,11 +30,24 @@ _LANG_ALIASES = {
     "en": "en",
 }
 
+# Exact-case spellings that iOS and the backend actually send, so the common
+# case resolves with one dict lookup and no str.lower() allocation
+_LANG_EXACT: Dict[str, str] = {
+    **_LANG_ALIASES,
+    "zh-CN": "zh-Hans",
+    "zh-Hans": "zh-Hans",
+    "zh-TW": "zh-Hant",
+    "zh-Hant": "zh-Hant",
+}
+
 def normalize_language(language: Optional[str], fallback: str = "en") -> str:
     """Normalize any incoming language code to a canonical key used in this file."""
     if not language:
         return fallback
-    return _LANG_ALIASES.get(language.lower(), fallback)
+    canonical = _LANG_EXACT.get(language)
+    if canonical is None:
+        canonical = _LANG_ALIASES.get(language.lower(), fallback)
+    return canonical
 
 
 # ---------------------------------------------------------------------------
@@ -44,7 +57,7 @@ def normalize_language(language: Optional[str], fallback: str = "en") -> str:
 # Keep instructions short and unambiguous so the model follows them reliably.
 # ---------------------------------------------------------------------------
 
-RANDOM_QUESTIONS_LANG_INSTRUCTION = {
+RANDOM_QUESTIONS_LANG_INSTRUCTION: Dict[str, str] = {
     "en": (
         "Write all question text, answer options, explanations, and topic fields in English."
     ),
@@ -59,7 +72,7 @@ RANDOM_QUESTIONS_LANG_INSTRUCTION = {
 }
 
 # User-turn trigger message (the short "Generate now" line sent as the user role)
-RANDOM_QUESTIONS_USER_MESSAGE = {
+RANDOM_QUESTIONS_USER_MESSAGE: Dict[str, str] = {
     "en":      "Generate {count} random questions for {subject} now.",
     "zh-Hans": "请立即为{subject}生成{count}道练习题。",
     "zh-Hant": "請立即為{subject}生成{count}道練習題。",
@@ -69,7 +82,7 @@ RANDOM_QUESTIONS_USER_MESSAGE = {
 # Archive-based question generation — language instruction + user message
 # ---------------------------------------------------------------------------
 
-ARCHIVE_QUESTIONS_LANG_INSTRUCTION = {
+ARCHIVE_QUESTIONS_LANG_INSTRUCTION: Dict[str, str] = {
     "en": (
         "Write all question text, answer options, explanations, and topic fields in English."
     ),
@@ -83,7 +96,7 @@ ARCHIVE_QUESTIONS_LANG_INSTRUCTION = {
     ),
 }
 
-ARCHIVE_QUESTIONS_USER_MESSAGE = {
+ARCHIVE_QUESTIONS_USER_MESSAGE: Dict[str, str] = {
     "en":      "Generate {count} personalized questions based on the conversation history for {subject}.",
     "zh-Hans": "请根据对话历史为{subject}生成{count}道个性化练习题。",
     "zh-Hant": "請根據對話歷史為{subject}生成{count}道個性化練習題。",
@@ -93,7 +106,7 @@ ARCHIVE_QUESTIONS_USER_MESSAGE = {
 # Mistake-based question generation — language instruction + user message
 # ---------------------------------------------------------------------------
 
-MISTAKE_QUESTIONS_LANG_INSTRUCTION = {
+MISTAKE_QUESTIONS_LANG_INSTRUCTION: Dict[str, str] = {
     "en": (
         "Write all question text, answer options, explanations, and topic fields in English."
     ),
@@ -107,7 +120,7 @@ MISTAKE_QUESTIONS_LANG_INSTRUCTION = {
     ),
 }
 
-MISTAKE_QUESTIONS_USER_MESSAGE = {
+MISTAKE_QUESTIONS_USER_MESSAGE: Dict[str, str] = {
     "en":      "Generate {count} remedial questions based on the mistake patterns for {subject}.",
     "zh-Hans": "请根据错题模式为{subject}生成{count}道补救练习题。",
     "zh-Hant": "請根據錯題模式為{subject}生成{count}道補救練習題。",
@@ -120,7 +133,7 @@ MISTAKE_QUESTIONS_USER_MESSAGE = {
 # Keep it short — the model must still follow strict JSON schema rules.
 # ---------------------------------------------------------------------------
 
-HOMEWORK_LANG_INSTRUCTION = {
+HOMEWORK_LANG_INSTRUCTION: Dict[str, str] = {
     "en": "",  # No extra instruction needed for English
     "zh-Hans": (
         "\n\nLANGUAGE: Write all 'feedback', 'summary_text', and 'overall_feedback' text fields "
@@ -141,7 +154,7 @@ HOMEWORK_LANG_INSTRUCTION = {
 # is_correct, confidence, correct_answer) must stay in English for iOS parser.
 # ---------------------------------------------------------------------------
 
-GRADING_FEEDBACK_LANG_INSTRUCTION = {
+GRADING_FEEDBACK_LANG_INSTRUCTION: Dict[str, str] = {
     "en": "",  # No extra instruction needed for English
     "zh-Hans": (
         "\n\nLANGUAGE: Write the 'feedback' field value in Simplified Chinese (简体中文). "
@@ -152,3 +165,11 @@ GRADING_FEEDBACK_LANG_INSTRUCTION = {
         "Keep all other JSON field names and non-text values (score, is_correct, confidence, correct_answer) in English."
     ),
 }
+
+# Raw language code (lowercased) → grading feedback instruction, so the grading
+# hot path needs one lookup instead of normalize_language() + .get().
+# Codes not listed normalize to "en", which has no instruction.
+GRADING_FEEDBACK_LANG_INSTRUCTION_BY_ALIAS: Dict[str, str] = {
+    alias: GRADING_FEEDBACK_LANG_INSTRUCTION.get(code, "")
+    for alias, code in _LANG_ALIASES.items()
+}
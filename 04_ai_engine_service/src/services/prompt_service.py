@@ -7,6 +7,7 @@ and intelligent response formatting for different academic domains.
 
 from typing import Dict, List, Optional, Any
 from enum import Enum
+import functools
 import re
 from .prompt_i18n import normalize_language, RANDOM_QUESTIONS_LANG_INSTRUCTION, ARCHIVE_QUESTIONS_LANG_INSTRUCTION, MISTAKE_QUESTIONS_LANG_INSTRUCTION
 
@@ -23,6 +24,37 @@ class Subject(Enum):
     GENERAL = "general"
 
 
+# Substring -> subject, checked in order (built once, not per call)
+_SUBJECT_MAPPING = {
+    'math': Subject.MATHEMATICS,
+    'mathematics': Subject.MATHEMATICS,
+    'algebra': Subject.MATHEMATICS,
+    'geometry': Subject.MATHEMATICS,
+    'calculus': Subject.MATHEMATICS,
+    'statistics': Subject.MATHEMATICS,
+    'physics': Subject.PHYSICS,
+    'chemistry': Subject.CHEMISTRY,
+    'biology': Subject.BIOLOGY,
+    'history': Subject.HISTORY,
+    'literature': Subject.LITERATURE,
+    'computer': Subject.COMPUTER_SCIENCE,
+    'programming': Subject.COMPUTER_SCIENCE,
+    'economics': Subject.ECONOMICS,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _detect_subject(subject_string: str) -> Subject:
+    """Memoized subject detection; requests reuse a handful of subject strings."""
+    subject_lower = subject_string.lower()
+
+    for key, subject in _SUBJECT_MAPPING.items():
+        if key in subject_lower:
+            return subject
+
+    return Subject.GENERAL
+
+
 class PromptTemplate:
     def __init__(self, subject: Subject, base_prompt: str, formatting_rules: List[str], examples: List[str]):
         self.subject = subject
@@ -40,6 +72,11 @@ class AdvancedPromptService:
     def __init__(self):
         self.prompt_templates = self._initialize_prompt_templates()
         self.math_subjects = {Subject.MATHEMATICS, Subject.PHYSICS, Subject.CHEMISTRY}
+        # Per-instance memo of assembled system prompts, keyed only on the inputs
+        # that shape them: repeat calls skip the re-join and hand OpenAI a
+        # byte-identical prefix, so its server-side prompt caching can hit
+        self._build_enhanced_prompt = functools.lru_cache(maxsize=1024)(self._assemble_enhanced_prompt)
+        self._build_session_prompt = functools.lru_cache(maxsize=64)(self._assemble_session_prompt)
     
     def _initialize_prompt_templates(self) -> Dict[Subject, PromptTemplate]:
         """Initialize specialized prompt templates for different subjects."""
@@ -105,30 +142,7 @@ class AdvancedPromptService:
     
     def detect_subject(self, subject_string: str) -> Subject:
         """Detect the academic subject from a string."""
-        subject_lower = subject_string.lower()
-        
-        subject_mapping = {
-            'math': Subject.MATHEMATICS,
-            'mathematics': Subject.MATHEMATICS,
-            'algebra': Subject.MATHEMATICS,
-            'geometry': Subject.MATHEMATICS,
-            'calculus': Subject.MATHEMATICS,
-            'statistics': Subject.MATHEMATICS,
-            'physics': Subject.PHYSICS,
-            'chemistry': Subject.CHEMISTRY,
-            'biology': Subject.BIOLOGY,
-            'history': Subject.HISTORY,
-            'literature': Subject.LITERATURE,
-            'computer': Subject.COMPUTER_SCIENCE,
-            'programming': Subject.COMPUTER_SCIENCE,
-            'economics': Subject.ECONOMICS,
-        }
-        
-        for key, subject in subject_mapping.items():
-            if key in subject_lower:
-                return subject
-                
-        return Subject.GENERAL
+        return _detect_subject(subject_string)
     
     def create_enhanced_prompt(self, question: str, subject_string: str, context: Optional[Dict] = None) -> str:
         """
@@ -143,13 +157,22 @@ class AdvancedPromptService:
             Enhanced prompt optimized for the specific subject and context
         """
         subject = self.detect_subject(subject_string)
-        template = self.prompt_templates.get(subject, self.prompt_templates[Subject.GENERAL])
 
         # Extract language from context (default to 'en')
         user_language = 'en'
         if context and 'language' in context:
             user_language = context['language']
 
+        # The question text never enters the system prompt; context only
+        # contributes its formatted instructions
+        context_instructions = self._format_context_instructions(context) if context else None
+
+        return self._build_enhanced_prompt(subject, user_language, context_instructions)
+
+    def _assemble_enhanced_prompt(self, subject: Subject, user_language: str, context_instructions: Optional[str]) -> str:
+        """Assemble the enhanced system prompt (memoized via _build_enhanced_prompt)."""
+        template = self.prompt_templates.get(subject, self.prompt_templates[Subject.GENERAL])
+
         # Language-specific instructions
         language_instructions = {
             'en': 'Respond in clear, educational English.',
@@ -181,11 +204,11 @@ class AdvancedPromptService:
             ])
         
         # Add context-specific instructions
-        if context:
+        if context_instructions is not None:
             system_prompt_parts.extend([
                 "",
                 "STUDENT CONTEXT:",
-                self._format_context_instructions(context)
+                context_instructions
             ])
         
         # 🚀 OPTIMIZATION: Shortened math formatting rules (from 26 lines to 6 lines)
@@ -673,7 +696,7 @@ Remember: Your goal is to help the student learn and understand both the image c
 
         return combined_prompt
     
-    def create_session_conversation_prompt(self, message: str, session_id: str, context: Optional[Dict] = None) -> str:
+    def create_session_conversation_prompt(self, message: Optional[str] = None, session_id: Optional[str] = None, context: Optional[Dict] = None) -> str:
         """
         Create specialized prompts for session-based conversations.
         
@@ -684,9 +707,14 @@ Remember: Your goal is to help the student learn and understand both the image c
         - Conversational flow and engagement
         - Session-specific context handling
         
+        The result is a static prefix: per-turn values (message, session_id) are
+        never interpolated, so the system prompt stays byte-identical across turns
+        and OpenAI's automatic prompt-prefix caching can hit. Per-turn content
+        belongs in the user message.
+
         Args:
-            message: The student's message in the conversation
-            session_id: Unique session identifier for context
+            message: Accepted for compatibility; not part of the prompt
+            session_id: Accepted for compatibility; not part of the prompt
             context: Optional context information
             
         Returns:
@@ -699,7 +727,12 @@ Remember: Your goal is to help the student learn and understand both the image c
             subject_hint = context['subject']
         
         subject = self.detect_subject(subject_hint)
-        
+
+        # message/session_id don't shape the prompt, so it is shared across turns
+        return self._build_session_prompt(subject, bool(context and context.get('conversation_history')))
+
+    def _assemble_session_prompt(self, subject: Subject, has_history: bool) -> str:
+        """Assemble the session system prompt (memoized via _build_session_prompt)."""
         # 🚀 OPTIMIZATION: Shortened session prompt (from 200+ to ~100 tokens)
         system_prompt_parts = [
             "You are StudyAI, an expert AI tutor. Use warm, conversational tone.",
@@ -728,7 +761,7 @@ Remember: Your goal is to help the student learn and understand both the image c
             ])
         
         # Add context-specific instructions (minimal)
-        if context and context.get('conversation_history'):
+        if has_history:
             system_prompt_parts.append("- Build on previous conversation")
             system_prompt_parts.append("")
 
@@ -1118,16 +1151,18 @@ Generate now:"""
             all_source_tags.extend(tags)
 
             # Build mistake summary with hierarchical error analysis if available
-            mistake_line = f"Mistake #{i}:\n"
-            mistake_line += f"  Question: {m.get('original_question', m.get('question_text', 'N/A'))[:150]}...\n"
-            mistake_line += f"  Student Answer: {m.get('user_answer', m.get('student_answer', 'N/A'))[:100]}\n"
-            mistake_line += f"  Correct Answer: {m.get('correct_answer', 'N/A')[:100]}\n"
+            mistake_parts = [
+                f"Mistake #{i}:\n",
+                f"  Question: {m.get('original_question', m.get('question_text', 'N/A'))[:150]}...\n",
+                f"  Student Answer: {m.get('user_answer', m.get('student_answer', 'N/A'))[:100]}\n",
+                f"  Correct Answer: {m.get('correct_answer', 'N/A')[:100]}\n",
+            ]
 
             # ✅ OPTIMIZED: Add hierarchical taxonomy (new fields) with fallback to old fields
             if m.get('error_type'):
                 error_type = m['error_type']
                 error_types.append(error_type)
-                mistake_line += f"  Error Classification: {error_type}\n"
+                mistake_parts.append(f"  Error Classification: {error_type}\n")
 
             # Hierarchical taxonomy (new structure): base_branch -> detailed_branch
             base_branch = m.get('base_branch') or m.get('primary_concept')
@@ -1135,19 +1170,19 @@ Generate now:"""
 
             if base_branch:
                 base_branches.append(base_branch)
-                mistake_line += f"  Topic Area: {base_branch}\n"
+                mistake_parts.append(f"  Topic Area: {base_branch}\n")
 
             if detailed_branch:
                 detailed_branches.append(detailed_branch)
-                mistake_line += f"  Specific Topic: {detailed_branch}\n"
+                mistake_parts.append(f"  Specific Topic: {detailed_branch}\n")
 
             # specific_issue is the targeted description of what went wrong
             specific_issue = m.get('specific_issue') or m.get('error_evidence')
             if specific_issue:
                 specific_issues.append(specific_issue)
-                mistake_line += f"  What Went Wrong: {specific_issue[:150]}\n"
+                mistake_parts.append(f"  What Went Wrong: {specific_issue[:150]}\n")
 
-            mistakes_summary.append(mistake_line)
+            mistakes_summary.append("".join(mistake_parts))
 
         unique_source_tags = list(set(all_source_tags))
 
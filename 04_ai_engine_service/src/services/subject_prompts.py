@@ -18,6 +18,8 @@ Supported Subjects (13 total):
 - Creative Arts: Art, Music, Physical Education
 """
 
+import functools
+
 
 class SubjectPromptGenerator:
     """
@@ -584,10 +586,14 @@ IF court/field diagram:
 # Module-level convenience function
 # ============================================================================
 
+@functools.lru_cache(maxsize=32)
 def get_subject_specific_rules(subject: str) -> str:
     """
     Convenience function to get subject-specific rules.
 
+    Memoized per subject string; the rules are static text, and 32 slots
+    cover every SUBJECT_MAP key and alias.
+
     Args:
         subject: Subject name or iOS enum value
 